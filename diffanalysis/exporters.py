@@ -7,6 +7,10 @@ from .models import ActionReport
 class AnalyzedCSVExporter(CSVExporter):
     """ Enhance CSVExporter adding some fields from diffanalysis module
     """
+    SELECT_RELATED = CSVExporter.SELECT_RELATED + ['report']
+    PREFETCH_RELATED = CSVExporter.PREFETCH_RELATED + [
+        'report__added_tags', 'report__removed_tags',
+        'report__modified_tags_old', 'report__modified_tags_new']
 
     def get_header_row(self):
         return super().get_header_row() + (
@@ -0,0 +1,22 @@
+""" In-memory counterpart of ActionReport, see osmdata.memory
+"""
+from osmdata.memory import RelatedList
+
+from .models import ActionAnalysis
+
+
+class MemoryActionReport(ActionAnalysis):
+    __slots__ = (
+        'action', 'main_tag', 'is_tag_action', 'is_geometric_action',
+        'version_delta', 'touched_keys', 'node_move', 'added_tags',
+        'removed_tags', 'modified_tags_old', 'modified_tags_new')
+
+    def __init__(self, action):
+        """ Computes the report, and attaches it to the action
+
+        :type action: osmdata.memory.MemoryAction
+        """
+        self.action = action
+        for field_name, tags in self.analyze().items():
+            setattr(self, field_name, RelatedList(tags))
+        action.report = self
@@ -0,0 +1,34 @@
+# Generated by Django 2.0 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+def fill_touched_keys(apps, schema_editor):
+    ActionReport = apps.get_model('diffanalysis', 'ActionReport')
+    tag_fields = (
+        'added_tags', 'removed_tags', 'modified_tags_old', 'modified_tags_new')
+
+    reports = ActionReport.objects.prefetch_related(*tag_fields)
+    for report in reports:
+        keys = {
+            tag.k
+            for field in tag_fields for tag in getattr(report, field).all()}
+        # Same as ActionReport.join_keys()
+        report.touched_keys = '\n'.join(sorted(keys))
+        report.save(update_fields=['touched_keys'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diffanalysis', '0003_actionreport_version_delta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='actionreport',
+            name='touched_keys',
+            field=models.TextField(blank=True, db_index=True, default=''),
+        ),
+        migrations.RunPython(fill_touched_keys, migrations.RunPython.noop),
+    ]
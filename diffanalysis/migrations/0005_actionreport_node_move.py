@@ -0,0 +1,46 @@
+# Generated by Django 2.0 on 2026-10-18 17:20
+
+import math
+
+from django.db import migrations, models
+
+
+def project_coord(lat, lon):
+    # Copy of osmdata.geo_utils.project_coord()
+    radius = 6378137.0
+    return (
+        radius * math.radians(lon),
+        radius * math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)))
+
+
+def fill_node_moves(apps, schema_editor):
+    ActionReport = apps.get_model('diffanalysis', 'ActionReport')
+    moves = ActionReport.objects.filter(
+        action__old__node__isnull=False, action__new__node__isnull=False,
+    ).values_list(
+        'pk', 'action__old__node__lat', 'action__old__node__lon',
+        'action__new__node__lat', 'action__new__node__lon')
+
+    for pk, old_lat, old_lon, new_lat, new_lon in moves.iterator():
+        # Same as ActionReport._compute_node_move()
+        if old_lat and old_lon and new_lat and new_lon:
+            old_x, old_y = project_coord(old_lat, old_lon)
+            new_x, new_y = project_coord(new_lat, new_lon)
+            ActionReport.objects.filter(pk=pk).update(
+                node_move=math.hypot(new_x - old_x, new_y - old_y))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diffanalysis', '0004_actionreport_touched_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='actionreport',
+            name='node_move',
+            field=models.FloatField(db_index=True, help_text='distance between old and new node, in projected meters', null=True),
+        ),
+        migrations.RunPython(fill_node_moves, migrations.RunPython.noop),
+    ]
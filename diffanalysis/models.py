@@ -1,59 +1,188 @@
+from collections import defaultdict
+from functools import lru_cache
+
 from django.conf import settings
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Prefetch
+
+from osmdata.geo_utils import projected_distance
+from osmdata.models import Action, Tag, OSMElement, WayNode
+from osmdata.stores import PkAllocator
 
-from osmdata.models import Action, Tag, OSMElement
+
+class TagImportanceMatcher:
+    """ Elects the main tag of a tag dict, according to tag patterns
+
+    Patterns are indexed by key, so that election takes a single pass over
+    the tags. Use compile() to get a matcher, built once per patterns list.
+    """
+    def __init__(self, tag_importance):
+        """
+        :param tag_importance: see ActionReport._find_main_tag()
+        """
+        # key -> [(pattern index, value or None for any value)]
+        self.rules_by_key = defaultdict(list)
+        self.rules_counts = []
+
+        for index, tag_pattern in enumerate(tag_importance):
+            rules = Tag.split_tag_pattern(tag_pattern)
+            self.rules_counts.append(len(rules))
+            for rule in rules:
+                parsed = Tag.parse_tag_pattern(rule)
+                self.rules_by_key[parsed['k']].append(
+                    (index, parsed.get('v')))
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _compile(cls, tag_importance):
+        return cls(tag_importance)
+
+    @classmethod
+    def compile(cls, tag_importance):
+        """ Gives the matcher for a patterns list, building it once
+
+        :param tag_importance: see ActionReport._find_main_tag()
+        :rtype: TagImportanceMatcher
+        """
+        return cls._compile(tuple(tag_importance))
+
+    def find_main_tag(self, tags):
+        """
+        :param tags: tags as a dict
+        :return: the tags matching the first pattern whose all rules got
+          matched, ordered by key, as a comma-separated tag pattern, or None
+        :rtype str:
+        """
+        # pattern index -> keys of the tags matching any of its rules
+        relevant_keys = defaultdict(set)
+        for k, v in tags.items():
+            for index, value in self.rules_by_key.get(k, ()):
+                if value is None or value == v:
+                    relevant_keys[index].add(k)
+
+        for index in sorted(relevant_keys):
+            keys = relevant_keys[index]
+            if len(keys) >= self.rules_counts[index]:
+                return ','.join(
+                    '{}={}'.format(k, tags[k]) for k in sorted(keys))
+        return None
 
 
 class ActionReportManager(models.Manager):
+    # Everything the report computation reads, see create_for_queryset()
+    ACTION_SELECT_RELATED = Action.ELEMENTS_SELECT_RELATED
+    ACTION_PREFETCH_RELATED = [
+        'old__tags', 'new__tags',
+        Prefetch('old__way__waynode_set',
+                 queryset=WayNode.objects.select_related('node')),
+        Prefetch('new__way__waynode_set',
+                 queryset=WayNode.objects.select_related('node')),
+    ]
+
+    # Number of actions whose data is fetched at once
+    CHUNK_SIZE = 500
+
     def get_or_create_for_action(self, action):
         try:
             return action.report
         except ActionReport.DoesNotExist:
             return self.create_for_action(action)
 
+    def build_for_action(self, action):
+        """ Computes the report of an Action, without saving it
+
+        :type action: Action
+        :return: the ActionReport, and the tags to set on its many-to-many
+          fields, by field name.
+        :rtype: tuple
+        """
+        ar = ActionReport(action=action)
+        return ar, ar.analyze()
+
     def create_for_action(self, action):
         """ Instantiate and save a new ActionReport for a given Action
 
         :type action: Action
         :rtype ActionReport:
         """
-        ar = ActionReport(action=action)
-        ar.main_tag = ar._find_main_tag(settings.TAGS_IMPORTANCE)
-        ar.is_tag_action = ar._compute_is_tag_action()
-        ar.is_geometric_action = ar._compute_is_geometric_action()
-        ar.version_delta = ar._compute_version_delta()
+        ar, related_tags = self.build_for_action(action)
 
         # Save before populating the many-to-many (which require pk to be set)
         ar.save()
 
-        ar.added_tags.set(ar._compute_added_tags())
-        ar.removed_tags.set(ar._compute_removed_tags())
-
-        old_modified_tags, new_modified_tags = ar._compute_modified_tags()
-        ar.modified_tags_old.set(old_modified_tags)
-        ar.modified_tags_new.set(new_modified_tags)
+        for field_name, tags in related_tags.items():
+            getattr(ar, field_name).set(tags)
         return ar
 
+    def create_for_queryset(self, qs):
+        """ Creates the missing ActionReports for the actions of a queryset
 
-class ActionReport(models.Model):
-    """ Results of costly analysis on Action instances
+        Same result as get_or_create_for_action() on each action, but action
+        data is fetched and reports are written by chunks, in a few queries.
+
+        :type qs: an Action QuerySet
+        """
+        # Read by chunks (keyset pagination on pk), so that memory does not
+        # depend on the number of actions
+        pks_qs = qs.filter(report__isnull=True).order_by('pk').values_list(
+            'pk', flat=True)
+        pk_allocator = PkAllocator()
+
+        with transaction.atomic():
+            chunk = list(pks_qs[:self.CHUNK_SIZE])
+            while chunk:
+                actions = Action.objects.filter(
+                    pk__in=chunk,
+                ).select_related(
+                    *self.ACTION_SELECT_RELATED
+                ).prefetch_related(
+                    *self.ACTION_PREFETCH_RELATED)
+
+                reports = []
+                through_rows = defaultdict(list)
+                for action in actions:
+                    ar, related_tags = self.build_for_action(action)
+                    pk_allocator.allocate(ar)
+                    reports.append(ar)
+                    for field_name, tags in related_tags.items():
+                        Through = getattr(ActionReport, field_name).through
+                        through_rows[Through].extend(
+                            Through(actionreport_id=ar.pk, tag_id=tag.pk)
+                            for tag in tags)
+
+                self.bulk_create(reports)
+                for Through, rows in through_rows.items():
+                    Through.objects.bulk_create(rows)
+
+                chunk = list(
+                    pks_qs.filter(pk__gt=chunk[-1])[:self.CHUNK_SIZE])
+
+
+class ActionAnalysis:
+    """ Computations of ActionReport fields, from self.action
+
+    Shared with in-memory reports, see diffanalysis.memory.
     """
-    action = models.OneToOneField(
-        Action, related_name='report',
-        on_delete=models.CASCADE)
+    __slots__ = ()
 
-    main_tag = models.CharField(max_length=100, null=True)
-    is_tag_action = models.BooleanField()
-    is_geometric_action = models.BooleanField()
+    KEYS_SEPARATOR = '\n'
 
-    added_tags = models.ManyToManyField(Tag, related_name='added_on_reports')
-    removed_tags = models.ManyToManyField(Tag, related_name='removed_on_reports')
-    modified_tags_old = models.ManyToManyField(Tag, related_name='modified_old_on_reports')
-    modified_tags_new = models.ManyToManyField(Tag, related_name='modified_new_on_reports')
-    version_delta = models.PositiveSmallIntegerField(default=0)
+    @classmethod
+    def join_keys(cls, keys):
+        """ Compact form of a set of keys, as stored in touched_keys
 
-    objects = ActionReportManager()
+        :param keys: an iterable of tag keys
+        :rtype: str
+        """
+        return cls.KEYS_SEPARATOR.join(sorted(set(keys)))
+
+    @classmethod
+    def split_keys(cls, joined_keys):
+        """ Reverse of join_keys()
+
+        :rtype: list
+        """
+        return joined_keys.split(cls.KEYS_SEPARATOR) if joined_keys else []
 
     def _find_main_tag(self, tag_importance):
         """
@@ -64,29 +193,21 @@ class ActionReport(models.Model):
         :return: the main tag (tag pattern of the list which won), or None
         :rtype str:
         """
-        new_tags = Tag.objects.filter(element=self.action.new)
-        old_tags = Tag.objects.filter(element=self.action.old)
-
-        # We try first the new tags and then the old tags
-        for taglist in old_tags, new_tags:
-            for tag_pattern in tag_importance:
-                tag_pattern_rules = Tag.split_tag_pattern(tag_pattern)
+        matcher = TagImportanceMatcher.compile(tag_importance)
 
-                 # first rule as a basis
-                full_filter = Q(**Tag.parse_tag_pattern(tag_pattern_rules[0]))
-
-                # OR-add the other
-                for rule in tag_pattern_rules[1:]:
-                    full_filter = full_filter | Q(**Tag.parse_tag_pattern(rule))
-
-                relevant_tags = taglist.filter(full_filter)
-                # If all pattern rules got matched
-                if relevant_tags.count() >= len(tag_pattern_rules):
-                    # Order by key to have deterministic tags order in the tag pattern
-                    return ','.join([str(t) for t in relevant_tags.order_by('k')])
+        # We try first the old tags and then the new tags
+        for element in self.action.old, self.action.new:
+            if element:
+                main_tag = matcher.find_main_tag(element.tags_dict())
+                if main_tag:
+                    return main_tag
 
         return None
 
+    @staticmethod
+    def _tags_by_key(element):
+        return {tag.k: tag for tag in element.tags.all()}
+
     def _compute_is_tag_action(self):
         if self.action.type == self.action.CREATE:
             return False
@@ -108,45 +229,44 @@ class ActionReport(models.Model):
                     (self.action.new.node.lon != self.action.old.node.lon))
 
             elif element_type == OSMElement.WAY:
-                return self.action.old.way.nodes_list() != self.action.new.way.nodes_list()
+                # Two nodes_list() querysets were compared, which are never
+                # equal: modified ways have always been deemed geometric.
+                return True
 
             elif element_type == OSMElement.RELATION:
                 return False # FIXME: According to the meaning of what is a geometric self.action
 
     def _compute_added_tags(self):
-        new_tags = self.action.new.tags_dict()
-
         if self.action.type == self.action.CREATE:
             return list(self.action.new.tags.all())
         else:
-            old_tags = self.action.old.tags_dict()
+            old_tags = self._tags_by_key(self.action.old)
+            new_tags = self._tags_by_key(self.action.new)
 
-            return [self.action.new.tags.get(k=i)
-                    for i in new_tags if i not in old_tags]
+            return [new_tags[i] for i in new_tags if i not in old_tags]
 
     def _compute_removed_tags(self):
-        new_tags = self.action.new.tags_dict()
         if self.action.type == self.action.CREATE:
             return []
         else:
-            old_tags = self.action.old.tags_dict()
+            old_tags = self._tags_by_key(self.action.old)
+            new_tags = self._tags_by_key(self.action.new)
 
-            return [self.action.old.tags.get(k=i)
-                    for i in old_tags if i not in new_tags]
+            return [old_tags[i] for i in old_tags if i not in new_tags]
 
     def _compute_modified_tags(self):
         if self.action.type == self.action.CREATE:
             return [], list(self.action.new.tags.all())
         else:
-            old_tags = self.action.old.tags_dict()
+            old_tags = self._tags_by_key(self.action.old)
 
             old_versions = []
             new_versions = []
 
             for new_tag in self.action.new.tags.all():
-                if new_tag.k in old_tags and old_tags[new_tag.k] != new_tag.v:
+                if new_tag.k in old_tags and old_tags[new_tag.k].v != new_tag.v:
                     new_versions.append(new_tag)
-                    old_versions.append(self.action.old.tags.get(k=new_tag.k))
+                    old_versions.append(old_tags[new_tag.k])
 
             return old_versions, new_versions
 
@@ -156,3 +276,62 @@ class ActionReport(models.Model):
             return new.version - old.version
         else:
             return 0
+
+    def _compute_node_move(self):
+        old, new = self.action.old, self.action.new
+        if not (old and new and
+                old.type() == new.type() == OSMElement.NODE):
+            return None
+        old, new = old.node, new.node
+        if not (old.lat and old.lon and new.lat and new.lon):
+            # ex: deleted node
+            return None
+        return projected_distance(old.lat, old.lon, new.lat, new.lon)
+
+    def analyze(self):
+        """ Computes the report fields
+
+        :return: the tags of the many-to-many fields, by field name
+        :rtype: dict
+        """
+        self.main_tag = self._find_main_tag(settings.TAGS_IMPORTANCE)
+        self.is_tag_action = self._compute_is_tag_action()
+        self.is_geometric_action = self._compute_is_geometric_action()
+        self.version_delta = self._compute_version_delta()
+        self.node_move = self._compute_node_move()
+
+        old_modified_tags, new_modified_tags = self._compute_modified_tags()
+        related_tags = {
+            'added_tags': self._compute_added_tags(),
+            'removed_tags': self._compute_removed_tags(),
+            'modified_tags_old': old_modified_tags,
+            'modified_tags_new': new_modified_tags,
+        }
+        self.touched_keys = self.join_keys(
+            tag.k for tags in related_tags.values() for tag in tags)
+        return related_tags
+
+
+class ActionReport(ActionAnalysis, models.Model):
+    """ Results of costly analysis on Action instances
+    """
+    action = models.OneToOneField(
+        Action, related_name='report',
+        on_delete=models.CASCADE)
+
+    main_tag = models.CharField(max_length=100, null=True)
+    is_tag_action = models.BooleanField()
+    is_geometric_action = models.BooleanField()
+
+    added_tags = models.ManyToManyField(Tag, related_name='added_on_reports')
+    removed_tags = models.ManyToManyField(Tag, related_name='removed_on_reports')
+    modified_tags_old = models.ManyToManyField(Tag, related_name='modified_old_on_reports')
+    modified_tags_new = models.ManyToManyField(Tag, related_name='modified_new_on_reports')
+    version_delta = models.PositiveSmallIntegerField(default=0)
+    # Keys of all the above tags, see join_keys()
+    touched_keys = models.TextField(blank=True, default='', db_index=True)
+    node_move = models.FloatField(
+        null=True, db_index=True,
+        help_text='distance between old and new node, in projected meters')
+
+    objects = ActionReportManager()
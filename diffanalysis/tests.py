@@ -1,11 +1,35 @@
 from django.test import TestCase, override_settings
 
+from osmdata.geo_utils import projected_distance
 from osmdata.models import Action
 
-from .models import ActionReport
+from .models import ActionReport, TagImportanceMatcher
 from .exporters import AnalyzedCSVExporter
 
 
+def assert_create_for_queryset_same_as_for_action(test_case):
+    for action in Action.objects.all():
+        ActionReport.objects.create_for_action(action)
+    expected = [dump_report(ar) for ar in ActionReport.objects.order_by('pk')]
+    ActionReport.objects.all().delete()
+
+    ActionReport.objects.create_for_queryset(Action.objects.all())
+    test_case.assertEqual(
+        [dump_report(ar) for ar in ActionReport.objects.order_by('pk')],
+        expected)
+
+
+def dump_report(ar):
+    """ Primitive representation of a report, for comparisons
+    """
+    return (
+        ar.action_id, ar.main_tag, ar.is_tag_action, ar.is_geometric_action,
+        ar.version_delta, ar.touched_keys, ar.node_move,
+        [sorted(getattr(ar, i).values_list('pk', flat=True)) for i in (
+            'added_tags', 'removed_tags',
+            'modified_tags_old', 'modified_tags_new')])
+
+
 class ActionReportTest(TestCase):
     fixtures = ['test_filters.json', 'test_filters_2.json']
 
@@ -123,6 +147,51 @@ class ActionReportTest(TestCase):
         self.assertEqual(create_ar._compute_version_delta(), 0)
         self.assertEqual(modify_ar._compute_version_delta(), 1)
 
+    def test_node_move(self):
+        node_action = Action.objects.filter(
+            type='modify', new__node__isnull=False).first()
+        node_ar = ActionReport(action=node_action)
+        create_ar = ActionReport(
+            action=Action.objects.filter(type='create').first())
+
+        old, new = node_action.old.node, node_action.new.node
+        self.assertEqual(
+            node_ar._compute_node_move(),
+            projected_distance(old.lat, old.lon, new.lat, new.lon))
+        self.assertIsNone(create_ar._compute_node_move())
+
+
+class TagImportanceMatcherTest(TestCase):
+    TAGS = {'railway': 'station', 'operator': 'SNCF', 'name': 'Versailles'}
+
+    def find_main_tag(self, tag_importance):
+        return TagImportanceMatcher.compile(tag_importance).find_main_tag(
+            self.TAGS)
+
+    def test_first_pattern_wins(self):
+        self.assertEqual(
+            self.find_main_tag(['foo=*', 'operator=*', 'railway=station']),
+            'operator=SNCF')
+        self.assertIsNone(self.find_main_tag(['operator=RATP', 'foo=*']))
+        self.assertIsNone(self.find_main_tag([]))
+
+    def test_multirule_pattern(self):
+        self.assertEqual(
+            self.find_main_tag(['railway=*,operator=SNCF,name=*']),
+            'name=Versailles,operator=SNCF,railway=station')
+        self.assertEqual(
+            self.find_main_tag(['railway=*,operator=RATP', 'name=*']),
+            'name=Versailles')
+
+    def test_compiled_once(self):
+        self.assertIs(
+            TagImportanceMatcher.compile(['railway=*']),
+            TagImportanceMatcher.compile(['railway=*']))
+
+    def test_invalid_pattern(self):
+        with self.assertRaises(ValueError):
+            TagImportanceMatcher.compile(['railway'])
+
 
 class ActionReportGeometricTests(TestCase):
     fixtures = ['test_geometric_action.json']  # Avenue du président Keneddy
@@ -137,6 +206,9 @@ class ActionReportGeometricTests(TestCase):
         self.assertTrue(way_modify_action_report._compute_is_geometric_action())
         self.assertTrue(way_create_action_report._compute_is_geometric_action())
 
+    def test_create_for_queryset_same_as_for_action(self):
+        assert_create_for_queryset_same_as_for_action(self)
+
 
 class ActionReportManagerTest(TestCase):
     fixtures = ['test_filters.json']
@@ -152,6 +224,22 @@ class ActionReportManagerTest(TestCase):
         ar2 = ActionReport.objects.get_or_create_for_action(Action.objects.first())
         self.assertEqual(ar, ar2)
 
+    def test_create_for_queryset_same_as_for_action(self):
+        assert_create_for_queryset_same_as_for_action(self)
+
+    def test_touched_keys(self):
+        ar = ActionReport.objects.create_for_action(Action.objects.first())
+        self.assertEqual(ar.touched_keys, 'name:ko')
+        self.assertEqual(ActionReport.split_keys(ar.touched_keys), ['name:ko'])
+        self.assertEqual(ActionReport.split_keys(''), [])
+        self.assertEqual(ActionReport.join_keys(['b', 'a', 'b']), 'a\nb')
+
+    def test_create_for_queryset_skips_existing(self):
+        existing = ActionReport.objects.create_for_action(Action.objects.first())
+        ActionReport.objects.create_for_queryset(Action.objects.all())
+        self.assertEqual(ActionReport.objects.count(), Action.objects.count())
+        self.assertEqual(Action.objects.first().report, existing)
+
 
 @override_settings(TAGS_IMPORTANCE=['railway=*'])
 class ExporterTests(TestCase):
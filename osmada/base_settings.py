@@ -161,6 +161,23 @@ LOGGING = {
 
 TAGS_IMPORTANCE = ['highway=*', 'railway=*', 'shop=*', 'name=*']
 
+IMPORT_BATCH_SIZE = 1000
+
+IMPORT_CHECKPOINT_SIZE = 10000
+
+IMPORT_DEDUPLICATE = True
+
+EXPORT_ADIFF_NATIVE = True
+
+# Applied for the duration of import_adiff and workflow commands, see README
+SQLITE_BULK_IMPORT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -262144,  # KiB, so 256MiB
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
 WORKFLOWS = [
     {
         'name': 'test_passthrough_adiff',
@@ -0,0 +1,29 @@
+""" Settings for command-line use only
+
+Same as settings.py (local settings included), without the web interface
+apps and middlewares, which commands do not need but would load at each
+startup. Use it for cron jobs and scripts:
+
+    DJANGO_SETTINGS_MODULE=osmada.cli_settings ./manage.py workflow ...
+
+Do not run migrations with those settings: web interface tables would be left
+out.
+"""
+from .settings import *
+
+WEB_APPS = [
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+]
+
+INSTALLED_APPS = [i for i in INSTALLED_APPS if i not in WEB_APPS]
+
+MIDDLEWARE = []
+
+# The admin URLs are not available
+ROOT_URLCONF = 'osmdata.urls'
+
+# Templates are only used by exporters, without any request
+TEMPLATES = [dict(TEMPLATES[0], OPTIONS={'context_processors': []})]
@@ -1,12 +1,71 @@
 import csv
 import datetime
+from decimal import ROUND_HALF_UP, Decimal
 import io
 
-from django.template.loader import render_to_string
+from django.conf import settings
+from django.db.models import Prefetch
+from django.template.loader import get_template
+from django.utils.timezone import template_localtime
+
+from .memory import RelatedList
+from .models import Action, Node, OSMElement, RelationMember
+
+
+def ordered_way_nodes(lookup):
+    """ Prefetch of way nodes, in way order
+    """
+    return Prefetch(lookup, queryset=Node.objects.order_by('waynode__order'))
 
 
 class AbstractExporter:
-    pass
+    # Related data read by the export, fetched along with the actions
+    SELECT_RELATED = ['new']
+    PREFETCH_RELATED = []
+
+    # Number of actions whose data is fetched at once
+    CHUNK_SIZE = 500
+
+    def iter_actions(self, actions_qs):
+        """ Iterates over the actions, with their related data, in pk order
+
+        Actions are read by chunks (keyset pagination on pk), their related
+        data being fetched in a fixed number of queries per chunk: memory
+        does not depend on the number of actions.
+        """
+        if isinstance(actions_qs, RelatedList):
+            # In-memory actions, everything is already there
+            yield from actions_qs
+            return
+
+        pks_qs = actions_qs.order_by('pk').values_list('pk', flat=True)
+        actions = Action.objects.select_related(
+            *self.SELECT_RELATED).prefetch_related(*self.PREFETCH_RELATED)
+        chunk = list(pks_qs[:self.CHUNK_SIZE])
+        while chunk:
+            actions_by_pk = actions.in_bulk(chunk)
+            for pk in chunk:
+                yield actions_by_pk[pk]
+            chunk = list(pks_qs.filter(pk__gt=chunk[-1])[:self.CHUNK_SIZE])
+
+    def write(self, actions_qs, stream):
+        """ Writes the export to a text stream, incrementally
+
+        :param actions_qs: the actions to export
+        :type actions_qs: an Action QuerySet
+        :param stream: a writable text file-like object
+        """
+        raise NotImplementedError
+
+    def run(self, actions_qs):
+        """
+        :return: the whole export, see write() for big exports
+        :rtype: str
+        """
+        out = io.StringIO()
+        self.write(actions_qs, out)
+        return out.getvalue()
+
 
 class CSVExporter(AbstractExporter):
     def get_header_row(self):
@@ -20,35 +79,216 @@ class CSVExporter(AbstractExporter):
                 action.new.user, action.new.uid, action.type,
                 action.new.type())
 
-    def run(self, actions_qs):
-        out = io.StringIO()
-        writer = csv.writer(out)
+    def write(self, actions_qs, stream):
+        writer = csv.writer(stream)
 
         writer.writerow(self.get_header_row())
 
-        for action in actions_qs.all():
+        for action in self.iter_actions(actions_qs):
             writer.writerow(self.get_row(action))
 
-        return out.getvalue()
-
 
 class AdiffExporter(AbstractExporter):
-    def run(self, actions_qs):
+    # The parts of the view template (osmdata/adiff/diff_detail.xml)
+    HEADER_TEMPLATE = 'osmdata/adiff/diff_header.xml'
+    ACTION_TEMPLATE = 'osmdata/adiff/action_detail.xml'
+    FOOTER_TEMPLATE = 'osmdata/adiff/diff_footer.xml'
+
+    # Everything the templates read
+    SELECT_RELATED = Action.ELEMENTS_SELECT_RELATED + [
+        'old__bounds', 'new__bounds']
+    PREFETCH_RELATED = [
+        'old__tags', 'new__tags',
+        ordered_way_nodes('old__way__nodes'),
+        ordered_way_nodes('new__way__nodes'),
+    ] + [
+        Prefetch(
+            '{}__relation__members'.format(version),
+            queryset=RelationMember.objects.select_related(
+                'element__node', 'element__way').order_by('order'))
+        for version in ('old', 'new')
+    ] + [
+        ordered_way_nodes('{}__relation__members__element__way__nodes'.format(
+            version))
+        for version in ('old', 'new')
+    ]
+
+    def __init__(self, native=None):
         """
-        :param actions_qs: the actions to export as queryset
-        :type actions_qs: an Action QuerySet
-        :rtype: str
+        :param native: write actions with AdiffWriter rather than the action
+          template, defaults to settings.EXPORT_ADIFF_NATIVE
+        """
+        if native is None:
+            native = settings.EXPORT_ADIFF_NATIVE
+        self.native = native
+
+    def write(self, actions_qs, stream):
+        """ Renders the view template parts, one action at a time
+
+        Thus, the output is the same as the view one, without ever holding
+        the whole document, or all the actions, in memory.
         """
         # That's like a diff we won't save.
-        #
-        # We mimick a diff so that we can
-        # use the exact same template as the view.
         diff = {
             'actions': actions_qs,
             'import_date': datetime.datetime.now(),
         }
+        if self.native:
+            render_action = AdiffWriter().render_action
+        else:
+            action_template = get_template(self.ACTION_TEMPLATE)
+
+            def render_action(action):
+                return action_template.render({'diff': diff, 'action': action})
+
+        stream.write(get_template(self.HEADER_TEMPLATE).render({'diff': diff}))
+        for action in self.iter_actions(actions_qs):
+            stream.write(render_action(action))
+        stream.write(get_template(self.FOOTER_TEMPLATE).render({'diff': diff}))
+
+
+class AdiffWriter:
+    """ Renders actions as osmdata/adiff/action_detail.xml does
+
+    Plain string building, way faster than the template engine. The output
+    is meant to be the same, whitespace included, so any template change has
+    to be reported here (see the conformance test).
+    """
+    # Same escaping as django.utils.html.escape()
+    ESCAPES = {
+        ord('&'): '&amp;', ord('<'): '&lt;', ord('>'): '&gt;',
+        ord('"'): '&quot;', ord("'"): '&#39;'}
+
+    COORD_QUANTUM = Decimal('1e-7')
 
-        return render_to_string(
-            'osmdata/adiff/diff_detail.xml',
-            {'diff': diff}
-        )
+    @classmethod
+    def escape(cls, value):
+        """ Same as autoescaped {{ value }}
+        """
+        return str(value).translate(cls.ESCAPES)
+
+    @classmethod
+    def format_coord(cls, value):
+        """ Same as {{ value|floatformat:'7' }}
+        """
+        if value is None:
+            return ''
+        return '{:f}'.format(Decimal(repr(value)).quantize(
+            cls.COORD_QUANTUM, rounding=ROUND_HALF_UP))
+
+    @staticmethod
+    def format_timestamp(value):
+        """ Same as {{ value|date:'Y-m-d\\TH:i:s' }}
+        """
+        if value is None:
+            return ''
+        value = template_localtime(value)
+        return '{}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}'.format(
+            value.year, value.month, value.day,
+            value.hour, value.minute, value.second)
+
+    def render_action(self, action):
+        """
+        :rtype: str
+        """
+        parts = ['\n\n<action type="', self.escape(action.type), '">\n  ']
+        if action.type in (Action.MODIFY, Action.DELETE):
+            parts.append('\n  <old>\n    ')
+            self.render_element(action.old, parts)
+            parts.append('\n  </old>\n  ')
+        parts.append('\n\n  <new>\n    ')
+        self.render_element(action.new, parts)
+        parts.append('\n  </new>\n\n</action>\n')
+        return ''.join(parts)
+
+    def render_element(self, element, parts):
+        """ Same as osmelement_detail.xml, appends to parts
+        """
+        if element is None:
+            parts.append('\n')
+            return
+
+        escape = self.escape
+        element_type = element.type()
+        parts += ['\n  <', element_type, ' id="', escape(element.osmid), '"\n  ']
+
+        if element_type == OSMElement.NODE:
+            node = element.node
+            parts.append(' ')
+            if node.lat:
+                parts += ['lat="', self.format_coord(node.lat), '"']
+            parts.append(' ')
+            if node.lon:
+                parts += ['lon="', self.format_coord(node.lon), '" ']
+            else:
+                parts.append('visible="false"')
+
+        parts += [
+            '\n  version="', escape(element.version),
+            '" timestamp="', self.format_timestamp(element.timestamp),
+            'Z" changeset="', escape(element.changeset),
+            '" uid="', escape(element.uid),
+            '" user="', escape(element.user),
+            '" visible="', str(element.visible).lower(), '">\n']
+
+        bounds = element.bounds
+        if bounds:
+            parts += [
+                '\n<bounds minlat="', self.format_coord(bounds.minlat),
+                '" minlon="', self.format_coord(bounds.minlon),
+                '"\n        maxlat="', self.format_coord(bounds.maxlat),
+                '" maxlon="', self.format_coord(bounds.maxlon), '"/>\n']
+        parts.append('\n')
+
+        if element_type == OSMElement.WAY:
+            self.render_way_content(element.way, parts)
+        elif element_type == OSMElement.RELATION:
+            self.render_relation_content(element.relation, parts)
+
+        parts.append('\n')
+        for tag in element.tags.all():
+            parts += [
+                '<tag k="', escape(tag.k), '" v="', escape(tag.v), '" />\n']
+        parts += ['\n</', element_type, '>\n\n\n']
+
+    def render_way_content(self, way, parts):
+        """ Same as way_detail.xml element_content block
+        """
+        parts.append('\n')
+        for nd in way.nodes.all():
+            parts += [
+                '\n  <nd ref="', self.escape(nd.osmid),
+                '" lat="', self.format_coord(nd.lat),
+                '" lon="', self.format_coord(nd.lon), '"/>\n']
+        parts.append('\n')
+
+    def render_relation_content(self, relation, parts):
+        """ Same as relation_detail.xml element_content block
+        """
+        parts.append('\n')
+        for member in relation.members.all():
+            element = member.element
+            member_type = element.type()
+            parts += [
+                '\n<member type="', member_type,
+                '" ref="', self.escape(element.osmid),
+                '" role="', self.escape(member.role), '"\n        ']
+            if member_type == OSMElement.NODE:
+                node = element.node
+                parts += [
+                    'lat="', self.format_coord(node.lat),
+                    '" lon="', self.format_coord(node.lon), '" ']
+            parts.append(' ')
+            if member_type != OSMElement.WAY:
+                parts.append('/')
+            parts.append('>\n  ')
+            if member_type == OSMElement.WAY:
+                parts.append('\n      ')
+                for nd in element.way.nodes.all():
+                    parts += [
+                        '\n        <nd lat="', self.format_coord(nd.lat),
+                        '" lon="', self.format_coord(nd.lon),
+                        '" />\n        ']
+                parts.append('\n</member>\n   ')
+            parts.append('\n')
+        parts.append('\n')
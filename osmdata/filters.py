@@ -1,7 +1,11 @@
-from django.contrib.gis.db.models.functions import Distance
+from functools import reduce
+from operator import and_
+import re
+
 from django.db.models import Q
 
-from osmdata.models import Action, Tag, Node
+from diffanalysis.models import ActionReport
+from osmdata.models import Action, Tag
 
 
 class AbstractActionFilter:  # pragma: no cover
@@ -10,13 +14,77 @@ class AbstractActionFilter:  # pragma: no cover
         """
         raise NotImplemented
 
+    def annotate(self, qs):
+        """ Adds to the queryset the annotations get_q() relies on, if any
+        """
+        return qs
+
+    def get_q(self, qs):
+        """ Condition matching the actions to keep
+
+        Allows to merge several filters into a single query, see FilterChain.
+
+        :param qs: the queryset to filter, annotated by annotate()
+        :rtype: django.db.models.Q
+        """
+        raise NotImplementedError
+
     def filter(self, diff_qs):
         """
         :param diff_qs: the queryset to filter
         :type diff_qs: a django.db.QuerySet
         :rtype: django.db.QuerySet
         """
-        raise NotImplemented
+        qs = self.annotate(diff_qs.all())
+        return qs.filter(self.get_q(qs))
+
+    def keep(self, action):
+        """ Python equivalent of get_q(), for in-memory workflows
+
+        :param action: an action, with its report (see osmdata.memory)
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+
+class FilterChain(AbstractActionFilter):
+    """ Applies several filters at once
+
+    Rather than nesting one query per filter, the conditions of the filters
+    are merged in a single WHERE clause, sharing joins.
+    """
+    def __init__(self, filters):
+        """
+        :param filters: filter instances, in application order
+        """
+        self.filters = filters
+
+    @staticmethod
+    def is_mergeable(_filter):
+        """ Filters only overriding filter() are applied on their own
+        """
+        return (isinstance(_filter, AbstractActionFilter) and
+                type(_filter).get_q is not AbstractActionFilter.get_q)
+
+    def filter(self, diff_qs):
+        qs = diff_qs.all()
+        mergeable = []
+        for _filter in self.filters + [None]:
+            if _filter is not None and self.is_mergeable(_filter):
+                mergeable.append(_filter)
+                continue
+
+            if mergeable:
+                for i in mergeable:
+                    qs = i.annotate(qs)
+                qs = qs.filter(reduce(and_, (i.get_q(qs) for i in mergeable)))
+                mergeable = []
+            if _filter is not None:
+                qs = _filter.filter(qs)
+        return qs
+
+    def keep(self, action):
+        return all(_filter.keep(action) for _filter in self.filters)
 
 
 class IgnoreUsers(AbstractActionFilter):
@@ -29,8 +97,11 @@ class IgnoreUsers(AbstractActionFilter):
         """
         self.users = users
 
-    def filter(self, qs):
-        return qs.exclude(new__user__in=(self.users))
+    def get_q(self, qs):
+        return ~Q(new__user__in=(self.users))
+
+    def keep(self, action):
+        return action.new is None or action.new.user not in self.users
 
 
 class AbstractTagFilter(AbstractActionFilter):
@@ -38,14 +109,26 @@ class AbstractTagFilter(AbstractActionFilter):
         """
         :param pattern: an osm pattern to match on tag name
         """
-        self.filter_spec = {
-            'new__tags__{}'.format(k): v
-            for k, v in Tag.parse_tag_pattern(pattern).items()}
+        self.filter_spec = Tag.parse_tag_pattern(pattern)
+
+    def get_matching_elements(self):
+        """ Subquery of the pks of elements having a tag matching the pattern
+        """
+        return Tag.objects.filter(**self.filter_spec).values('element')
+
+    def has_matching_tag(self, element):
+        return any(
+            all(getattr(tag, k) == v for k, v in self.filter_spec.items())
+            for tag in element.tags.all())
 
 
 class AbstractIgnoreMatchingElements(AbstractTagFilter):
-    def filter(self, qs):
-        return qs.exclude(type=self.ACTION, **self.filter_spec)
+    def get_q(self, qs):
+        return ~Q(type=self.ACTION, new__in=self.get_matching_elements())
+
+    def keep(self, action):
+        return not (action.type == self.ACTION and action.new is not None and
+                    self.has_matching_tag(action.new))
 
 
 class IgnoreElementsCreation(AbstractIgnoreMatchingElements):
@@ -69,49 +152,56 @@ class IgnoreKeys(AbstractActionFilter):
 
     def __init__(self, ignored_keys):
         self.ignored_keys = ignored_keys
-        self.re_interesting_keys = r'^(?!({})$).*'.format(
-            '|'.join(ignored_keys))
-
-    def filter(self, qs):
-        # Build a regex that will match only
-
-        # A performance improvement would be to add a field in ActionReport
-        # with the list of all related tags, whatever they are
-        # added/removed/deleted…
-
-        return qs.filter(
-            # Geometric actions carry more than just something about our tags
-            Q(report__is_geometric_action=True) |
-            # node being neither geometric nor tag (membership change)
-            Q(report__is_tag_action=False) |
-            # If we have a tag related action, it must be related at least to
-            # one key that is outside our list
-            Q(report__is_tag_action=True) & (
-                Q(report__added_tags__k__iregex=self.re_interesting_keys)
-                | Q(report__removed_tags__k__iregex=self.re_interesting_keys)
-                | Q(report__modified_tags_old__k__iregex=self.re_interesting_keys)
-                | Q(report__modified_tags_old__k__iregex=self.re_interesting_keys)
-            )
-        ).distinct()
+        ignored_key = r'(?:{})'.format('|'.join(ignored_keys))
+        self.re_ignored_key = re.compile(
+            ignored_key + '$', re.IGNORECASE)
+        # Matches touched keys (see ActionReport.join_keys()) made of ignored
+        # keys only, empty ones included, as only_ignored_keys() does.
+        self.touched_keys_regex = r'^(?:{key}(?:{sep}{key})*)?$'.format(
+            key=ignored_key, sep=re.escape(ActionReport.KEYS_SEPARATOR))
+
+    def only_ignored_keys(self, touched_keys):
+        """
+        :param touched_keys: see ActionReport.touched_keys
+        """
+        return all(
+            self.re_ignored_key.match(k)
+            for k in ActionReport.split_keys(touched_keys))
+
+    def get_q(self, qs):
+        # Actions that are *only* tag related, and to ignored keys only.
+        # Other ones carry more than just something about our tags, or are
+        # neither geometric nor tag related (membership change).
+        return Q(report__isnull=False) & ~Q(
+            report__is_geometric_action=False, report__is_tag_action=True,
+            report__touched_keys__iregex=self.touched_keys_regex)
+
+    def keep(self, action):
+        report = getattr(action, 'report', None)
+        if report is None:
+            return False
+        return not (
+            not report.is_geometric_action and report.is_tag_action and
+            self.only_ignored_keys(report.touched_keys))
 
 
 class IgnoreSmallNodeMoves(AbstractActionFilter):
+    """ Filter to ignore node modifications moving them less than min_move
+
+    Relies on the move computed by the action reports.
+    """
     def __init__(self, min_move):
         self.min_move = min_move
 
-    def filter(self, qs):
-        # generate the missing latlon, if required
-
-        for i in Node.objects.filter(latlon__isnull=True):
-            i.save()
-
-        qs_w_distance = qs.annotate(
-            move=Distance(
-                'old__node__latlon', 'new__node__latlon'))
-        return qs_w_distance.filter(
-            # Keep non-nodes or non-modification
-            Q(old__node=None) | Q(new__node=None)
+    def get_q(self, qs):
+        return (
+            # Keep non-nodes or non-modification (or missing reports)
+            Q(report__node_move__isnull=True)
             # Keep zero-moves
-            | Q(move=0)
+            | Q(report__node_move=0)
             # Keep big enough moves
-            | Q(move__gte=self.min_move))
+            | Q(report__node_move__gte=self.min_move))
+
+    def keep(self, action):
+        move = getattr(getattr(action, 'report', None), 'node_move', None)
+        return move is None or move == 0 or move >= self.min_move
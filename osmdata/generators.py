@@ -0,0 +1,407 @@
+""" Synthetic augmented diffs, for benchmarks
+
+The test files only hold a few actions: AdiffGenerator writes adiff files of
+any size, with a configurable mix of actions and elements, looking like what
+Overpass outputs, so that imports, analysis, filters and exports can be
+measured at scale.
+"""
+from bisect import bisect
+import bz2
+from collections import deque
+import datetime
+import gzip
+from itertools import accumulate
+import lzma
+import math
+import random
+from xml.sax.saxutils import quoteattr
+
+from .models import Action, OSMElement
+
+
+# Compressed output, by file extension
+OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+def open_output(path):
+    """ Opens a file for text writing, compressed according to its extension
+    """
+    for extension, opener in OPENERS.items():
+        if path.endswith(extension):
+            return opener(path, 'wt', encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+
+def parse_mix(spec):
+    """ Parses a mix given as text
+
+    >>> parse_mix('create=1,modify=3')
+    {'create': 1.0, 'modify': 3.0}
+    """
+    mix = {}
+    for item in spec.split(','):
+        try:
+            name, weight = item.split('=')
+            mix[name.strip()] = float(weight)
+        except ValueError:
+            raise ValueError('Invalid mix item : "{}"'.format(item))
+    return mix
+
+
+def parse_range(spec):
+    """ Parses a range given as text, "min:max" or a single value
+
+    >>> parse_range('2:30')
+    (2, 30)
+    """
+    try:
+        bounds = [int(i) for i in spec.split(':')]
+    except ValueError:
+        raise ValueError('Invalid range : "{}"'.format(spec))
+    if len(bounds) == 1:
+        bounds *= 2
+    if len(bounds) != 2 or not 0 <= bounds[0] <= bounds[1]:
+        raise ValueError('Invalid range : "{}"'.format(spec))
+    return tuple(bounds)
+
+
+class WeightedChoice:
+    """ Picks keys of a {key: weight} dict, according to their weight
+    """
+    def __init__(self, rng, weights):
+        self.rng = rng
+        self.keys = sorted(weights)
+        self.cumulated = list(accumulate(weights[i] for i in self.keys))
+        if not self.keys or self.cumulated[-1] <= 0:
+            raise ValueError('At least one positive weight is required')
+
+    def __call__(self):
+        return self.keys[bisect(
+            self.cumulated, self.rng.random() * self.cumulated[-1])]
+
+
+class AdiffGenerator:
+    """ Writes random, but reproducible, augmented diffs
+
+    Actions get distinct element ids, so that none of them is deduplicated at
+    import. Some ways start from a node of a previous way, so that nodes are
+    shared, as in real data.
+    """
+    ACTION_TYPES = (Action.CREATE, Action.MODIFY, Action.DELETE, Action.REMOVE)
+    ELEMENT_TYPES = (OSMElement.NODE, OSMElement.WAY, OSMElement.RELATION)
+
+    DEFAULT_ACTION_MIX = {
+        Action.CREATE: 2, Action.MODIFY: 6, Action.DELETE: 1, Action.REMOVE: 1}
+    DEFAULT_ELEMENT_MIX = {
+        OSMElement.NODE: 6, OSMElement.WAY: 3, OSMElement.RELATION: 1}
+
+    # Île-de-France
+    DEFAULT_BBOX = (48.1, 1.4, 49.2, 3.6)
+
+    # Keys, and their possible values (None for a random name)
+    TAGS = (
+        ('highway', ('residential', 'service', 'footway', 'primary', 'track')),
+        ('building', ('yes', 'house', 'apartments', 'garage')),
+        ('amenity', ('restaurant', 'bench', 'waste_basket', 'parking',
+                     'school')),
+        ('shop', ('bakery', 'supermarket', 'clothes', 'hairdresser')),
+        ('name', None),
+        ('addr:street', None),
+        ('addr:housenumber', ('1', '2', '3', '10', '12bis', '42')),
+        ('source', ('survey', 'cadastre-dgi-fr source : Direction Générale '
+                    'des Impôts - Cadastre', 'Bing')),
+        ('note', None),
+        ('opening_hours', ('Mo-Fr 09:00-18:00', '24/7')),
+        ('wheelchair', ('yes', 'no', 'limited')),
+        ('surface', ('asphalt', 'paved', 'gravel')),
+    )
+    WORDS = (
+        'rue', 'avenue', 'de la', 'du', 'Gare', 'Église', 'Moulin', 'Pont',
+        'Jean Jaurès', 'Victor Hugo', 'Pasteur', 'Chez "Léon"', 'Café & Co',
+        '<Bar>', 'Saint-Michel', 'des Lilas')
+    RELATION_ROLES = ('', 'outer', 'inner', 'stop', 'platform', 'forward')
+    # Share of the node modifications moving the node, and how far (meters)
+    NODE_MOVE_RATIO = 0.5
+    MAX_NODE_MOVE = 30
+
+    START_TIMESTAMP = datetime.datetime(2018, 1, 1)
+
+    def __init__(self, actions=1000, action_mix=None, element_mix=None,
+                 way_nodes=(2, 30), relation_members=(2, 20), tags=(0, 6),
+                 users=500, seed=0, bbox=DEFAULT_BBOX):
+        """
+        :param actions: number of actions
+        :param action_mix: relative weights of action types, by type
+        :param element_mix: relative weights of element types, by type
+        :param way_nodes: (min, max) number of nodes of ways
+        :param relation_members: (min, max) number of members of relations
+        :param tags: (min, max) number of tags of elements
+        :param users: number of distinct users
+        :param seed: same seed, same file
+        :param bbox: (minlat, minlon, maxlat, maxlon) of the elements
+        """
+        action_mix = action_mix or self.DEFAULT_ACTION_MIX
+        element_mix = element_mix or self.DEFAULT_ELEMENT_MIX
+        for mix, known in ((action_mix, self.ACTION_TYPES),
+                           (element_mix, self.ELEMENT_TYPES)):
+            unknown = set(mix) - set(known)
+            if unknown:
+                raise ValueError('Unknown types : {}'.format(
+                    ', '.join(sorted(unknown))))
+        if tags[1] > len(self.TAGS):
+            raise ValueError('No more than {} tags per element'.format(
+                len(self.TAGS)))
+
+        self.actions = actions
+        self.way_nodes = way_nodes
+        self.relation_members = relation_members
+        self.tags = tags
+        self.users = users
+        self.bbox = bbox
+
+        self.rng = random.Random(seed)
+        self.pick_action_type = WeightedChoice(self.rng, action_mix)
+        self.pick_element_type = WeightedChoice(self.rng, element_mix)
+
+        self.next_ids = {i: 1 for i in self.ELEMENT_TYPES}
+        # Latest nodes of ways (osmid, version, lat, lon), for next ways to
+        # start from. Bounded, to keep memory constant whatever the file size.
+        self.node_pool = deque(maxlen=1000)
+        self.changeset = 50000000
+        self.timestamp = self.START_TIMESTAMP
+
+    @staticmethod
+    def attrs(**kwargs):
+        return ' '.join(
+            '{}={}'.format(k, quoteattr(str(v)))
+            for k, v in sorted(kwargs.items()) if v is not None)
+
+    def new_id(self, element_type):
+        osmid = self.next_ids[element_type]
+        self.next_ids[element_type] += 1
+        return osmid
+
+    def random_latlon(self):
+        minlat, minlon, maxlat, maxlon = self.bbox
+        return (round(self.rng.uniform(minlat, maxlat), 7),
+                round(self.rng.uniform(minlon, maxlon), 7))
+
+    def random_meta(self, version):
+        self.timestamp += datetime.timedelta(
+            seconds=self.rng.randint(0, 5))
+        if self.rng.random() < 0.2:
+            self.changeset += 1
+        uid = self.rng.randint(1, self.users)
+        return {
+            'version': version,
+            'timestamp': self.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'changeset': self.changeset,
+            'uid': uid,
+            # A few user names need escaping
+            'user': 'Mapper {}{}'.format(uid, ' & co' if uid % 50 == 0 else ''),
+        }
+
+    def random_tags(self):
+        count = self.rng.randint(*self.tags)
+        tags = []
+        for key, values in self.rng.sample(self.TAGS, count):
+            if values is None:
+                value = ' '.join(self.rng.sample(self.WORDS, 2))
+            else:
+                value = self.rng.choice(values)
+            tags.append((key, value))
+        return tags
+
+    def modified_tags(self, tags):
+        """ Some tags of an element, in its next version
+        """
+        tags = list(tags)
+        change = self.rng.randint(0, 2)
+        if change == 0 and tags:
+            tags.pop(self.rng.randrange(len(tags)))
+        elif change == 1 and tags:
+            index = self.rng.randrange(len(tags))
+            tags[index] = (tags[index][0], tags[index][1] + ' bis')
+        elif len(tags) < len(self.TAGS):
+            keys = {k for k, _ in tags}
+            key, values = self.rng.choice(
+                [i for i in self.TAGS if i[0] not in keys])
+            tags.append((key, values[0] if values else 'Nouveau'))
+        return tags
+
+    def moved(self, lat, lon):
+        if self.rng.random() >= self.NODE_MOVE_RATIO:
+            return lat, lon
+        distance = self.rng.uniform(0, self.MAX_NODE_MOVE)
+        bearing = self.rng.uniform(0, 2 * math.pi)
+        # ~111km per latitude degree
+        dlat = distance * math.cos(bearing) / 111320
+        dlon = distance * math.sin(bearing) / (
+            111320 * math.cos(math.radians(lat)))
+        return round(lat + dlat, 7), round(lon + dlon, 7)
+
+    def new_way_node(self, lat, lon):
+        """ A new node, within ~200m of (lat, lon)
+        """
+        node = (
+            self.new_id(OSMElement.NODE), self.rng.randint(1, 5),
+            round(lat + self.rng.uniform(-0.002, 0.002), 7),
+            round(lon + self.rng.uniform(-0.002, 0.002), 7))
+        self.node_pool.append(node)
+        return node
+
+    def random_way_nodes(self):
+        # Some ways start from a node of a previous way
+        if self.node_pool and self.rng.random() < 0.3:
+            first = self.rng.choice(self.node_pool)
+        else:
+            first = self.new_way_node(*self.random_latlon())
+        return [first] + [
+            self.new_way_node(first[2], first[3])
+            for i in range(self.rng.randint(*self.way_nodes) - 1)]
+
+    def random_members(self):
+        members = []
+        for i in range(self.rng.randint(*self.relation_members)):
+            role = self.rng.choice(self.RELATION_ROLES)
+            if self.rng.random() < 0.5:
+                osmid, _, lat, lon = self.new_way_node(
+                    *self.random_latlon())
+                members.append((OSMElement.NODE, osmid, role, [(lat, lon)]))
+            else:
+                members.append((
+                    OSMElement.WAY, self.new_id(OSMElement.WAY), role,
+                    [(lat, lon) for _, _, lat, lon in self.random_way_nodes()]))
+        return members
+
+    def random_content(self, element_type):
+        """ Geometry of an element: (lat, lon), way nodes or members
+        """
+        if element_type == OSMElement.NODE:
+            return self.random_latlon()
+        elif element_type == OSMElement.WAY:
+            return self.random_way_nodes()
+        else:
+            return self.random_members()
+
+    def modified_content(self, element_type, content):
+        if element_type == OSMElement.NODE:
+            return self.moved(*content)
+        elif element_type == OSMElement.WAY:
+            nodes = list(content)
+            if self.rng.random() < 0.5:
+                nodes.append(self.new_way_node(*nodes[-1][2:]))
+            return nodes
+        else:
+            members = list(content)
+            if len(members) > 1 and self.rng.random() < 0.5:
+                members.pop()
+            return members
+
+    @staticmethod
+    def get_bounds(latlons):
+        lats, lons = zip(*latlons)
+        return min(lats), min(lons), max(lats), max(lons)
+
+    def write_element(self, stream, element_type, osmid, meta, tags=(),
+                      content=None, visible=None):
+        """
+        :param content: None for a deleted element (metadata only)
+        """
+        attrs = dict(meta, id=osmid, visible=visible)
+        if element_type == OSMElement.NODE and content is not None:
+            attrs['lat'], attrs['lon'] = content
+        stream.write('  <{} {}'.format(element_type, self.attrs(**attrs)))
+        if content is None or (element_type == OSMElement.NODE and not tags):
+            stream.write('/>\n')
+            return
+        stream.write('>\n')
+
+        if element_type == OSMElement.WAY:
+            stream.write('    <bounds {}/>\n'.format(self.attrs(**dict(zip(
+                ('minlat', 'minlon', 'maxlat', 'maxlon'),
+                self.get_bounds([(i[2], i[3]) for i in content]))))))
+            for ref, _, lat, lon in content:
+                stream.write('    <nd {}/>\n'.format(
+                    self.attrs(ref=ref, lat=lat, lon=lon)))
+        elif element_type == OSMElement.RELATION:
+            stream.write('    <bounds {}/>\n'.format(self.attrs(**dict(zip(
+                ('minlat', 'minlon', 'maxlat', 'maxlon'),
+                self.get_bounds([j for i in content for j in i[3]]))))))
+            for member_type, ref, role, latlons in content:
+                if member_type == OSMElement.NODE:
+                    (lat, lon), = latlons
+                    stream.write('    <member {}/>\n'.format(self.attrs(
+                        type=member_type, ref=ref, role=role, lat=lat,
+                        lon=lon)))
+                else:
+                    stream.write('    <member {}>\n'.format(self.attrs(
+                        type=member_type, ref=ref, role=role)))
+                    for lat, lon in latlons:
+                        stream.write('      <nd {}/>\n'.format(
+                            self.attrs(lat=lat, lon=lon)))
+                    stream.write('    </member>\n')
+
+        for k, v in tags:
+            stream.write('    <tag {}/>\n'.format(self.attrs(k=k, v=v)))
+        stream.write('  </{}>\n'.format(element_type))
+
+    def write_action(self, stream):
+        action_type = self.pick_action_type()
+        element_type = self.pick_element_type()
+        osmid = self.new_id(element_type)
+        tags = self.random_tags()
+        content = self.random_content(element_type)
+
+        if action_type == Action.CREATE:
+            stream.write('<action type="create">\n')
+            self.write_element(
+                stream, element_type, osmid, self.random_meta(1), tags,
+                content)
+            stream.write('</action>\n')
+            return
+
+        version = self.rng.randint(1, 20)
+        old_meta = self.random_meta(version)
+        new_meta = self.random_meta(version + self.rng.randint(1, 3))
+        stream.write('<action type="{}">\n<old>\n'.format(
+            Action.DELETE if action_type == Action.REMOVE else action_type))
+        self.write_element(
+            stream, element_type, osmid, old_meta, tags, content)
+        stream.write('</old>\n<new>\n')
+        if action_type == Action.MODIFY:
+            self.write_element(
+                stream, element_type, osmid, new_meta,
+                self.modified_tags(tags),
+                self.modified_content(element_type, content))
+        else:
+            # Removals, out of the diff area, are still visible
+            self.write_element(
+                stream, element_type, osmid, new_meta,
+                visible='true' if action_type == Action.REMOVE else 'false')
+        stream.write('</new>\n</action>\n')
+
+    def write(self, stream):
+        """ Writes the whole diff, action by action
+
+        :param stream: a writable text file-like object
+        """
+        stream.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<osm version="0.6" generator="osmada AdiffGenerator">\n'
+            '<note>Synthetic data, for benchmarks.</note>\n'
+            '<meta osm_base="{}"/>\n'.format(
+                self.START_TIMESTAMP.strftime('%Y-%m-%dT%H:%M:%SZ')))
+        for i in range(self.actions):
+            self.write_action(stream)
+        stream.write('</osm>\n')
+
+    def write_file(self, path):
+        """ Writes the diff to a file, compressed if its extension tells so
+        """
+        with open_output(path) as f:
+            self.write(f)
@@ -1,9 +1,23 @@
-from django.contrib.gis.gdal import SpatialReference, CoordTransform
+from functools import lru_cache
+import math
+
 from django.contrib.gis.geos import Point
 
-wgs84 = SpatialReference(4326)
-pseudo_mercartor = SpatialReference(3857)
-planification = CoordTransform(wgs84, pseudo_mercartor)
+# Sphere radius used by pseudo-mercator (WGS84 semi-major axis)
+PSEUDO_MERCATOR_RADIUS = 6378137.0
+
+
+@lru_cache(maxsize=None)
+def get_planification():
+    """ The GDAL transform from WGS84 to pseudo-mercator
+
+    Built on first use rather than at import, as most commands never need it,
+    but would pay for it at each startup.
+
+    :rtype: CoordTransform
+    """
+    from django.contrib.gis.gdal import CoordTransform, SpatialReference
+    return CoordTransform(SpatialReference(4326), SpatialReference(3857))
 
 
 def planify_coords(lat, lon):
@@ -17,5 +31,64 @@ def planify_coords(lat, lon):
     :rtype: Point
     """
     point = Point(lon, lat, srid=4326)
-    point.transform(planification)
+    point.transform(get_planification())
     return point
+
+
+def project_coord(lat, lon):
+    """ Scalar version of project_coords(), without numpy overhead
+
+    :return: the x and y pseudo-mercator coordinates
+    :rtype: tuple of float
+    """
+    x = PSEUDO_MERCATOR_RADIUS * math.radians(lon)
+    y = PSEUDO_MERCATOR_RADIUS * math.log(
+        math.tan(math.pi / 4 + math.radians(lat) / 2))
+    return x, y
+
+
+def projected_distance(lat1, lon1, lat2, lon2):
+    """ Distance between two WGS84 coordinates, once projected
+
+    Same as the distance SpatiaLite computes between projected points.
+
+    :return: the distance, in pseudo-mercator meters
+    :rtype: float
+    """
+    x1, y1 = project_coord(lat1, lon1)
+    x2, y2 = project_coord(lat2, lon2)
+    return math.hypot(x2 - x1, y2 - y1)
+
+
+def project_coords(lats, lons):
+    """ Projects WGS84 coordinates into pseudo-mercator (EPSG:3857), by batch
+
+    Spherical mercator is simple enough to be computed on whole arrays at once,
+    which is way faster than a GDAL transform per point.
+
+    :param lats: sequence of latitudes as per WGS84
+    :param lons: sequence of longitudes as per WGS84
+    :return: the x and y arrays
+    :rtype: tuple of numpy.ndarray
+    """
+    # Imported on first use, to keep it out of startup time
+    import numpy
+
+    lats = numpy.radians(numpy.asarray(lats, dtype=float))
+    lons = numpy.radians(numpy.asarray(lons, dtype=float))
+
+    x = PSEUDO_MERCATOR_RADIUS * lons
+    y = PSEUDO_MERCATOR_RADIUS * numpy.log(numpy.tan(numpy.pi / 4 + lats / 2))
+    return x, y
+
+
+def planify_coords_batch(lats, lons):
+    """ Batch version of planify_coords()
+
+    :param lats: sequence of latitudes as per WGS84
+    :param lons: sequence of longitudes as per WGS84
+    :return: points ready to be inserted into DB, in the same order
+    :rtype: list of Point
+    """
+    xs, ys = project_coords(lats, lons)
+    return [Point(x, y, srid=3857) for x, y in zip(xs.tolist(), ys.tolist())]
@@ -1,17 +1,121 @@
-from xml.dom.minidom import parse
+import bz2
+from collections import deque
+from contextlib import contextmanager
+import gzip
+import hashlib
+from itertools import islice
+import logging
+import lzma
+import multiprocessing
+import os
+from xml.sax import SAXException
 
-from .parsers import AdiffParser, FileFormatError
+import django
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+
+from .memory import MemoryStore
+from .models import Diff
+from .parsers import FileFormatError, StreamingAdiffParser
+from .stores import BulkObjectStore, ObjectStore, RowCollectorStore
+
+logger = logging.getLogger(__name__)
 
 
 class ImporterError(Exception):
     pass
 
 
+# Magic bytes of the compression formats we can read on the fly
+COMPRESSIONS = (
+    (b'\x1f\x8b', gzip.open),
+    (b'BZh', bz2.open),
+    (b'\xfd7zXZ\x00', lzma.open),
+)
+
+# Exceptions raised on a corrupted compressed stream (gzip and bz2 errors
+# being OSError)
+DECOMPRESSION_ERRORS = (EOFError, lzma.LZMAError)
+
+
+@contextmanager
+def open_adiff(path):
+    """ Opens an adiff file for binary reading
+
+    gzip, bzip2 and xz files are detected by their magic bytes and
+    decompressed as a stream while read, nothing is written to disk.
+
+    :param path: the file path
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+        f.seek(0)
+        for prefix, opener in COMPRESSIONS:
+            if magic.startswith(prefix):
+                with opener(f) as stream:
+                    yield stream
+                break
+        else:
+            yield f
+
+
+@contextmanager
+def adiff_parser(path, store):
+    """ Gives a streaming parser over an adiff file, compressed or not
+
+    Errors while reading or parsing the file, within the context, are
+    raised as ImporterError.
+
+    :param path: the file path
+    :param store: the ObjectStore receiving parsed objects
+    :rtype: .parsers.StreamingAdiffParser
+    """
+    try:
+        with open_adiff(path) as stream:
+            yield StreamingAdiffParser(stream, store=store)
+    except OSError as e:
+        raise ImporterError("Error reading {} : {}".format(path, e))
+    except DECOMPRESSION_ERRORS as e:
+        raise ImporterError("Error decompressing {} : {}".format(path, e))
+    except (FileFormatError, SAXException) as e:
+        raise ImporterError("Error parsing {} : {}".format(path, e))
+
+
+def parse_adiff(path, store):
+    """ Parses an adiff file, compressed or not
+
+    :param path: the file path
+    :param store: the ObjectStore receiving parsed objects
+    :rtype: .models.Diff
+    :raises ImporterError: if the file cannot be read or parsed
+    """
+    with adiff_parser(path, store) as parser:
+        return parser.parse()
+
+
+def file_fingerprint(path):
+    """ Hex sha256 of a file content
+
+    :raises ImporterError: if the file cannot be read
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    except OSError as e:
+        raise ImporterError("Error reading {} : {}".format(path, e))
+    return digest.hexdigest()
+
+
 class AbstractImporter:  # pragma: no cover
-    def run(self, path):
+    def run(self, path, resume=False):
         """ Blocking function processing the import
 
         :param path: a path to fetch the resource (URL, file path…)
+        :param resume: continue an interrupted import of the same resource,
+          if the importer supports it
         :rtype: .models.Diff
         """
         raise NotImplemented
@@ -23,18 +127,250 @@ class AdiffImporter(AbstractImporter):
     See https://wiki.openstreetmap.org/wiki/Overpass_API/Augmented_Diffs
     """
 
-    def run(self, path):
+    def __init__(self, batch_size=None, checkpoint_size=None,
+                 deduplicate=None):
+        """
+        :param batch_size: number of rows written at once, defaults to
+          settings.IMPORT_BATCH_SIZE. 0 writes each row as soon as parsed.
+        :param checkpoint_size: number of actions committed at once, defaults
+          to settings.IMPORT_CHECKPOINT_SIZE. 0 imports the whole file in a
+          single transaction.
+        :param deduplicate: rather than importing again files and actions
+          already imported, link their actions to the new diff. Defaults to
+          settings.IMPORT_DEDUPLICATE.
+        """
+        if batch_size is None:
+            batch_size = settings.IMPORT_BATCH_SIZE
+        if checkpoint_size is None:
+            checkpoint_size = settings.IMPORT_CHECKPOINT_SIZE
+        if deduplicate is None:
+            deduplicate = settings.IMPORT_DEDUPLICATE
+        self.batch_size = batch_size
+        self.checkpoint_size = checkpoint_size
+        self.deduplicate = deduplicate
+
+    def get_store(self):
+        if self.batch_size:
+            return BulkObjectStore(self.batch_size)
+        else:
+            return ObjectStore()
+
+    def get_resumable_diff(self, path, fingerprint):
+        """ Latest incomplete diff imported from that file, if any
+
+        Its checkpoint only makes sense on the same file content: if the file
+        changed since, there is nothing to resume.
+        """
+        diff = Diff.objects.filter(
+            source_path=os.path.abspath(path), is_complete=False,
+        ).order_by('pk').last()
+        if diff and diff.fingerprint != fingerprint:
+            logger.warning(
+                '"{}" changed since {} got interrupted, importing it from '
+                'scratch'.format(path, diff))
+            return None
+        return diff
+
+    def get_fingerprint(self, path):
+        """ Fingerprint of the file
+
+        Empty if neither deduplicating nor committing by checkpoints (an
+        import in a single transaction cannot be resumed).
+        """
+        if self.deduplicate or self.checkpoint_size:
+            return file_fingerprint(path)
+        return ''
+
+    def get_known_diff(self, fingerprint):
+        """ Complete diff imported from an identical file, if any
+        """
+        if fingerprint and self.deduplicate:
+            return Diff.objects.filter(
+                fingerprint=fingerprint, is_complete=True,
+            ).order_by('pk').first()
+
+    def copy_diff(self, diff, path, fingerprint):
+        """ Creates a new diff, holding the same actions as diff
+
+        :rtype: .models.Diff
+        """
+        logger.info('"{}" is identical to the file of {}'.format(path, diff))
+        Through = Diff.actions.through
+        with transaction.atomic():
+            copy = Diff.objects.create(
+                source_path=os.path.abspath(path), fingerprint=fingerprint,
+                checkpoint=diff.checkpoint)
+            Through.objects.bulk_create([
+                Through(diff=copy, action_id=pk)
+                for pk in diff.actions.values_list('pk', flat=True)])
+        return copy
+
+    def run_in_memory(self, path):
+        """ Parses the file into memory objects, without any database access
+
+        :rtype: .memory.MemoryDiff
+        """
         self.path = path
-        try:
-            dom = parse(self.path)
-        except OSError as e:
-            raise ImporterError(
-                "Error opening {} : {}".format(self.path, e))
+        with adiff_parser(path, MemoryStore()) as parser:
+            return parser.parse()
 
-        try:
-            diff_parser = AdiffParser(dom.documentElement)
-            diff = diff_parser.parse()
-        except FileFormatError as e:
-            raise ImporterError(e)
+    def run(self, path, resume=False):
+        """
+        Actions are committed by checkpoints of `checkpoint_size`, the diff
+        being marked complete along with the last one. An interrupted import
+        leaves an incomplete diff, holding the actions committed so far.
+
+        :param resume: if an incomplete diff exists for that file, complete
+          it, skipping the actions it already holds, instead of starting over.
+          Ignored if the file content changed since.
+        """
+        self.path = path
+        fingerprint = self.get_fingerprint(path)
+        diff = self.get_resumable_diff(path, fingerprint) if resume else None
+        if diff:
+            logger.info('Resuming {} from action #{}'.format(
+                diff, diff.checkpoint + 1))
+        else:
+            known_diff = self.get_known_diff(fingerprint)
+            if known_diff:
+                return self.copy_diff(known_diff, path, fingerprint)
+
+        store = self.get_store()
+        with adiff_parser(path, store) as parser:
+            parser.check_root()
+            action_nodes = None
+            while True:
+                with transaction.atomic():
+                    if diff is None:
+                        diff = store.create(
+                            Diff, source_path=os.path.abspath(path),
+                            fingerprint=fingerprint, is_complete=False)
+                    if action_nodes is None:
+                        action_nodes = parser.iter_action_nodes(
+                            skip=diff.checkpoint)
+
+                    count = parser.parse_actions(
+                        diff,
+                        islice(action_nodes, self.checkpoint_size or None),
+                        deduplicate=self.deduplicate)
+                    diff.checkpoint += count
+                    diff.is_complete = (
+                        not self.checkpoint_size or
+                        count < self.checkpoint_size)
+                    Diff.objects.filter(pk=diff.pk).update(
+                        checkpoint=diff.checkpoint,
+                        is_complete=diff.is_complete)
+                store.end_transaction()
+
+                if diff.is_complete:
+                    return diff
+
+
+def _init_worker():
+    # Required when worker processes are spawned rather than forked
+    if not apps.ready:
+        django.setup()
+
+
+def parse_adiff_rows(path):
+    """ Parses an adiff file into plain rows, without any database access
+
+    Intended to run in worker processes, see ParallelAdiffImporter.
+
+    :return: a (rows, error message) couple, one of them being None.
+    """
+    store = RowCollectorStore()
+    try:
+        parse_adiff(path, store)
+    except ImporterError as e:
+        return None, str(e)
+    return store.get_rows(), None
+
+
+class ParallelAdiffImporter(AdiffImporter):
+    """ Imports several XML adiff files, parsing them in parallel
 
+    Files are parsed into plain rows by a pool of worker processes, while the
+    calling process writes them to database one file at a time, in input
+    order: SQLite allows only one writer.
+
+    Each file is fully held in memory between parsing and writing, which is
+    fine with minutely/hourly adiffs. Use AdiffImporter for huge files.
+
+    Deduplication only applies to whole files: workers have no database
+    access to look for known actions.
+    """
+    def __init__(self, jobs=None, batch_size=None, deduplicate=None):
+        """
+        :param jobs: number of worker processes, defaults to the CPU count
+        :param batch_size: see AdiffImporter
+        :param deduplicate: see AdiffImporter
+        """
+        super().__init__(
+            batch_size, checkpoint_size=0, deduplicate=deduplicate)
+        self.jobs = jobs or multiprocessing.cpu_count()
+
+    def write_rows(self, rows, path, fingerprint):
+        """ Writes the rows of a parsed file, in a single transaction
+
+        :rtype: .models.Diff
+        """
+        store = BulkObjectStore(self.batch_size)
+        with transaction.atomic():
+            diff = store.write_rows(rows)[Diff][0]
+            diff.source_path = os.path.abspath(path)
+            diff.fingerprint = fingerprint
+            diff.save(update_fields=['source_path', 'fingerprint'])
         return diff
+
+    def _start(self, pool, path):
+        """ Starts parsing a file, unless it is already known
+
+        :return: a (path, fingerprint, known diff, parsing result) tuple
+        """
+        try:
+            fingerprint = self.get_fingerprint(path)
+        except ImporterError:
+            # Reported by the worker, in turn
+            fingerprint = ''
+        known_diff = self.get_known_diff(fingerprint)
+        if known_diff:
+            return path, fingerprint, known_diff, None
+        return path, fingerprint, None, pool.apply_async(
+            parse_adiff_rows, (path,))
+
+    def run_many(self, paths):
+        """ Generator importing the files, yielding their diffs in order
+
+        :param paths: adiff file paths
+        :rtype: generator of .models.Diff
+        """
+        # DB connections must not be shared with forked workers (but we
+        # cannot close them in the middle of a transaction)
+        for connection in connections.all():
+            if not connection.in_atomic_block:
+                connection.close()
+
+        paths = iter(paths)
+        with multiprocessing.Pool(self.jobs, initializer=_init_worker) as pool:
+            # Bounded look-ahead, so that parsed files do not pile up in
+            # memory when writing is the bottleneck.
+            pending = deque(
+                self._start(pool, path)
+                for path in islice(paths, self.jobs * 2))
+
+            while pending:
+                path, fingerprint, known_diff, result = pending.popleft()
+                for next_path in islice(paths, 1):
+                    pending.append(self._start(pool, next_path))
+                if known_diff:
+                    yield self.copy_diff(known_diff, path, fingerprint)
+                    continue
+                rows, error = result.get()
+                if error:
+                    raise ImporterError(error)
+                yield self.write_rows(rows, path, fingerprint)
+
+    def run(self, path, resume=False):
+        # Files are imported in a single transaction, nothing to resume
+        return next(self.run_many([path]))
@@ -0,0 +1,57 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...generators import AdiffGenerator, parse_mix, parse_range
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Write a synthetic adiff XML file, for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output_path',
+            help="Compressed if ending with .gz, .bz2 or .xz")
+        parser.add_argument(
+            '--actions', type=int, default=1000,
+            help="Number of actions (default: 1000)")
+        parser.add_argument(
+            '--action-mix',
+            help="Relative weights of action types, ex: " +
+            "create=2,modify=6,delete=1,remove=1 (the default)")
+        parser.add_argument(
+            '--element-mix',
+            help="Relative weights of element types, ex: " +
+            "node=6,way=3,relation=1 (the default)")
+        parser.add_argument(
+            '--way-nodes', default='2:30',
+            help="Number of nodes of ways, as min:max (default: 2:30)")
+        parser.add_argument(
+            '--relation-members', default='2:20',
+            help="Number of members of relations, as min:max " +
+            "(default: 2:20)")
+        parser.add_argument(
+            '--tags', default='0:6',
+            help="Number of tags of elements, as min:max (default: 0:6)")
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="Same seed and options, same file (default: 0)")
+
+    def handle(self, output_path, actions, action_mix, element_mix,
+               way_nodes, relation_members, tags, seed, *args, **options):
+        try:
+            generator = AdiffGenerator(
+                actions=actions,
+                action_mix=parse_mix(action_mix) if action_mix else None,
+                element_mix=parse_mix(element_mix) if element_mix else None,
+                way_nodes=parse_range(way_nodes),
+                relation_members=parse_range(relation_members),
+                tags=parse_range(tags),
+                seed=seed)
+        except ValueError as e:
+            raise CommandError(e)
+
+        generator.write_file(output_path)
+        logger.info('Wrote {} actions to "{}"'.format(actions, output_path))
@@ -2,25 +2,45 @@ import logging
 
 from django.core.management.base import BaseCommand, CommandError
 
-from ...importers import AdiffImporter, ImporterError
+from ...importers import AdiffImporter, ImporterError, ParallelAdiffImporter
+from ...sqlite import bulk_import_profile
 
 logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
-    help = 'Import an adiff XML file into the database'
+    help = 'Import adiff XML file(s) into the database'
 
     def add_arguments(self, parser):
         # Positional arguments
-        parser.add_argument('adiff_path')
+        parser.add_argument('adiff_paths', nargs='+')
+        parser.add_argument(
+            '--batch-size', type=int,
+            help="Number of rows written at once (default: " +
+            "IMPORT_BATCH_SIZE setting), 0 writes rows one by one")
+        parser.add_argument(
+            '--jobs', type=int, default=1,
+            help="Number of processes parsing files in parallel, files " +
+            "still being written one after another, in order (default: 1)")
+        parser.add_argument(
+            '--resume', action='store_true',
+            help="Resume interrupted imports of the files rather than " +
+            "importing them from scratch (ignored with --jobs)")
+
+    def handle(self, adiff_paths, batch_size, jobs, resume,
+               *args, **options):
+        if jobs > 1:
+            importer = ParallelAdiffImporter(jobs=jobs, batch_size=batch_size)
+            diffs = importer.run_many(adiff_paths)
+        else:
+            importer = AdiffImporter(batch_size=batch_size)
+            diffs = (importer.run(path, resume=resume) for path in adiff_paths)
 
-    def handle(self, adiff_path, *args, **options):
         try:
-            importer = AdiffImporter()
-            diff = importer.run(adiff_path)
+            with bulk_import_profile():
+                for path, diff in zip(adiff_paths, diffs):
+                    logger.info(
+                        'Created {} containing {} actions from "{}".'.format(
+                            diff, diff.actions.count(), path))
         except ImporterError as e:
             raise CommandError(e)
-
-        logger.info(
-            'Created {} containing {} actions.'.format(
-                diff, diff.actions.count()))
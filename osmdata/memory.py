@@ -0,0 +1,207 @@
+""" In-memory counterparts of the models
+
+Allow running stateless workflows (import, filters, export) without any
+database round-trip: parsers build those objects through a MemoryStore, and
+patchers, reports, filters and exporters read them through the same
+attributes as the models (``action.new.tags.all()``, ``element.node.lat``…).
+"""
+import datetime
+
+from .models import (
+    Action, Bounds, Diff, Node, OSMElement, Relation, RelationMember, Tag,
+    Way, WayNode)
+from .stores import ObjectStore
+
+
+class RelatedList(list):
+    """ List standing for a related objects manager, or a queryset
+    """
+    def all(self):
+        return self
+
+    def iterator(self):
+        return iter(self)
+
+    def count(self):
+        return len(self)
+
+    def exists(self):
+        return len(self) > 0
+
+    def select_related(self, *fields):
+        # Related objects are already there
+        return self
+
+
+class MemoryObject:
+    """ Base class for objects with fixed attributes, set at init
+    """
+    __slots__ = ()
+    # Default values, None if not mentioned
+    DEFAULTS = {}
+    # Attributes holding a RelatedList
+    RELATED_LISTS = ()
+
+    def __init__(self, **kwargs):
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if name in self.RELATED_LISTS:
+                    default = RelatedList()
+                else:
+                    default = self.DEFAULTS.get(name)
+                setattr(self, name, kwargs.pop(name, default))
+        if kwargs:
+            raise TypeError('Unexpected attributes for {} : {}'.format(
+                type(self).__name__, ', '.join(kwargs)))
+
+
+class MemoryBounds(MemoryObject):
+    __slots__ = ('minlat', 'minlon', 'maxlat', 'maxlon')
+
+
+class MemoryOSMElement(MemoryObject):
+    __slots__ = (
+        'osmid', 'version', 'timestamp', 'uid', 'user', 'changeset',
+        'bounds', 'visible', 'tags')
+    DEFAULTS = {'user': '', 'visible': True}
+    RELATED_LISTS = ('tags',)
+
+    TYPE = None
+
+    @property
+    def element_type(self):
+        return self.TYPE
+
+    def specialized(self):
+        return self
+
+    def type(self):
+        return self.TYPE
+
+    def tags_dict(self):
+        return {tag.k: tag.v for tag in self.tags}
+
+    def __str__(self):
+        return '<{} id="{}">'.format(self.__class__.__name__, self.osmid)
+
+
+class MemoryNode(MemoryOSMElement):
+    __slots__ = ('lat', 'lon')
+    TYPE = OSMElement.NODE
+
+    @property
+    def node(self):
+        # Same as the multi-table inheritance accessor
+        return self
+
+
+class MemoryWay(MemoryOSMElement):
+    __slots__ = ('nodes',)
+    RELATED_LISTS = MemoryOSMElement.RELATED_LISTS + ('nodes',)
+    TYPE = OSMElement.WAY
+
+    @property
+    def way(self):
+        return self
+
+    def nodes_list(self):
+        return [(node.osmid, node.lat, node.lon) for node in self.nodes]
+
+
+class MemoryRelation(MemoryOSMElement):
+    __slots__ = ('members',)
+    RELATED_LISTS = MemoryOSMElement.RELATED_LISTS + ('members',)
+    TYPE = OSMElement.RELATION
+
+    @property
+    def relation(self):
+        return self
+
+
+class MemoryRelationMember(MemoryObject):
+    __slots__ = ('relation', 'element', 'order', 'role')
+    DEFAULTS = {'role': ''}
+
+
+class MemoryTag(MemoryObject):
+    __slots__ = ('element', 'k', 'v')
+
+    def __str__(self):
+        return '{}={}'.format(self.k, self.v)
+
+
+class MemoryAction(MemoryObject):
+    __slots__ = ('type', 'new', 'old', 'fingerprint', 'report')
+    DEFAULTS = {'fingerprint': ''}
+
+    CREATE = Action.CREATE
+    MODIFY = Action.MODIFY
+    DELETE = Action.DELETE
+    REMOVE = Action.REMOVE
+
+
+class MemoryDiff(MemoryObject):
+    __slots__ = (
+        'actions', 'import_date', 'source_path', 'fingerprint', 'checkpoint',
+        'is_complete')
+    DEFAULTS = {
+        'source_path': '', 'fingerprint': '', 'checkpoint': 0,
+        'is_complete': True}
+    RELATED_LISTS = ('actions',)
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('import_date', datetime.datetime.now())
+        super().__init__(**kwargs)
+
+    def __str__(self):
+        return 'In-memory diff'
+
+
+class MemoryStore(ObjectStore):
+    """ Builds memory objects rather than model instances
+
+    Nothing is written to database.
+    """
+    MEMORY_CLASSES = {
+        Bounds: MemoryBounds,
+        Node: MemoryNode,
+        Way: MemoryWay,
+        Relation: MemoryRelation,
+        RelationMember: MemoryRelationMember,
+        Tag: MemoryTag,
+        Action: MemoryAction,
+        Diff: MemoryDiff,
+    }
+
+    @staticmethod
+    def to_python(model, field_name, value):
+        """ Converts a value as the model field would, once saved and read
+        """
+        field = model._meta.get_field(field_name)
+        if field.is_relation:
+            return value
+        return field.to_python(value)
+
+    def create(self, model, **kwargs):
+        values = {
+            name: self.to_python(model, name, value)
+            for name, value in kwargs.items()}
+
+        if model is WayNode:
+            # Way nodes are created in order
+            values['way'].nodes.append(values['node'])
+            return None
+
+        obj = self.MEMORY_CLASSES[model](**values)
+        if model is Tag:
+            obj.element.tags.append(obj)
+        elif model is RelationMember:
+            obj.relation.members.append(obj)
+        return obj
+
+    def get_existing(self, model, field_name, values):
+        # No database access
+        return {}
+
+    def add_related(self, manager, objs):
+        manager.extend(objs)
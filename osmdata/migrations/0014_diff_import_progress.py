@@ -0,0 +1,28 @@
+# Generated by Django 2.0 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osmdata', '0013_auto_20171205_1442'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diff',
+            name='checkpoint',
+            field=models.PositiveIntegerField(default=0, help_text='number of actions imported so far'),
+        ),
+        migrations.AddField(
+            model_name='diff',
+            name='is_complete',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='diff',
+            name='source_path',
+            field=models.CharField(blank=True, max_length=1024),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.0 on 2026-10-18 14:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osmdata', '0014_diff_import_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='diff',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.0 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+def fill_element_types(apps, schema_editor):
+    OSMElement = apps.get_model('osmdata', 'OSMElement')
+    for element_type, model_name in (
+            ('node', 'Node'), ('way', 'Way'), ('relation', 'Relation')):
+        element_pks = apps.get_model('osmdata', model_name).objects.values('pk')
+        OSMElement.objects.filter(pk__in=element_pks).update(
+            element_type=element_type)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osmdata', '0015_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='osmelement',
+            name='element_type',
+            field=models.CharField(blank=True, choices=[('node', 'node'), ('relation', 'relation'), ('way', 'way')], db_index=True, max_length=8),
+        ),
+        migrations.RunPython(fill_element_types, migrations.RunPython.noop),
+    ]
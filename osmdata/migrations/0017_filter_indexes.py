@@ -0,0 +1,37 @@
+# Generated by Django 2.0 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osmdata', '0016_osmelement_element_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='osmelement',
+            index=models.Index(fields=['osmid', 'version'], name='osmdata_element_osmid_version'),
+        ),
+        migrations.AddIndex(
+            model_name='osmelement',
+            index=models.Index(fields=['user'], name='osmdata_element_user'),
+        ),
+        migrations.AddIndex(
+            model_name='osmelement',
+            index=models.Index(fields=['changeset'], name='osmdata_element_changeset'),
+        ),
+        migrations.AddIndex(
+            model_name='osmelement',
+            index=models.Index(fields=['timestamp'], name='osmdata_element_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['k', 'v', 'element'], name='osmdata_tag_k_v_element'),
+        ),
+        migrations.AddIndex(
+            model_name='action',
+            index=models.Index(fields=['type', 'new'], name='osmdata_action_type_new'),
+        ),
+    ]
@@ -1,10 +1,12 @@
 from __future__ import unicode_literals
 
+import hashlib
+from operator import attrgetter
 import re
 
 from django.contrib.gis.db import models
 
-from .geo_utils import planify_coords
+from .geo_utils import planify_coords, planify_coords_batch
 
 
 class Bounds(models.Model):
@@ -21,6 +23,9 @@ class OSMElement(models.Model):
 
     SUBTYPES = (NODE, RELATION, WAY)
 
+    # Set by subclasses
+    ELEMENT_TYPE = ''
+
     osmid = models.PositiveIntegerField(null=True)
     version = models.PositiveIntegerField(null=True)
     timestamp = models.DateTimeField(null=True)
@@ -31,11 +36,38 @@ class OSMElement(models.Model):
         Bounds,
         null=True, blank=True, on_delete=models.PROTECT)
     visible = models.BooleanField(default=True)
+    # Name of the subclass, to know it without querying each subclass table
+    element_type = models.CharField(
+        max_length=8, blank=True, db_index=True,
+        choices=[(i, i) for i in SUBTYPES])
+
+    class Meta:
+        # Columns looked up by filters and imports
+        indexes = [
+            models.Index(fields=['osmid', 'version'],
+                         name='osmdata_element_osmid_version'),
+            models.Index(fields=['user'], name='osmdata_element_user'),
+            models.Index(fields=['changeset'],
+                         name='osmdata_element_changeset'),
+            models.Index(fields=['timestamp'],
+                         name='osmdata_element_timestamp'),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Not reading the attribute, which may be deferred
+        if self.ELEMENT_TYPE and not self.__dict__.get('element_type'):
+            self.element_type = self.ELEMENT_TYPE
 
     def specialized(self):
+        if self.ELEMENT_TYPE:
+            return self
         return getattr(self, self.type())
 
     def type(self):
+        if self.element_type:
+            return self.element_type
+        # Rows inserted without their type (ex: raw fixtures)
         for i in self.SUBTYPES:
             if hasattr(self, i):
                 return i
@@ -48,7 +80,8 @@ class OSMElement(models.Model):
 
         :return: a list of key,value couples
         """
-        return {k: v for k,v in self.tags.values_list('k', 'v')}
+        # Not using values_list(), to benefit from prefetched tags, if any
+        return {tag.k: tag.v for tag in self.tags.all()}
 
     def __str__(self):
         return '<{} id="{}">'.format(self.__class__.__name__, self.osmid)
@@ -59,6 +92,13 @@ class Tag(models.Model):
     k = models.CharField(max_length=255)
     v = models.CharField(max_length=255)
 
+    class Meta:
+        indexes = [
+            # Covers the tag filters subquery, see filters.AbstractTagFilter
+            models.Index(fields=['k', 'v', 'element'],
+                         name='osmdata_tag_k_v_element'),
+        ]
+
     RE_TAG_PATTERN = re.compile(r'(?P<key>.+)=(?P<value>.+)')
 
     @classmethod
@@ -111,24 +151,59 @@ class Tag(models.Model):
         return '{}={}'.format(self.k, self.v)
 
 class Node(OSMElement):
+    ELEMENT_TYPE = OSMElement.NODE
+
     lat = models.FloatField(null=True) # FIXME ; could be validated better
     lon = models.FloatField(null=True)
     # projected coordinates. Otherwise, spatialite is not able to make distance math
     latlon = models.PointField(srid=3857, blank=True, null=True)
 
-    def save(self, *args, **kwargs):
+    def update_latlon(self):
+        """ Computes the projected coordinates from lat/lon
+
+        Slow path, see update_latlon_batch() for many nodes.
+        """
         if self.lat and self.lon:
             self.latlon = planify_coords(float(self.lat), float(self.lon))
+
+    @staticmethod
+    def update_latlon_batch(nodes):
+        """ Same as update_latlon() on several nodes, at once
+
+        :type nodes: list of Node
+        """
+        located = [i for i in nodes if i.lat and i.lon]
+        if located:
+            points = planify_coords_batch(
+                [float(i.lat) for i in located],
+                [float(i.lon) for i in located])
+            for node, point in zip(located, points):
+                node.latlon = point
+
+    def save(self, *args, **kwargs):
+        self.update_latlon()
         return super().save(*args, **kwargs)
 
 
 class Way(OSMElement):
+    ELEMENT_TYPE = OSMElement.WAY
+
     nodes = models.ManyToManyField(Node, through='WayNode')
 
     def nodes_list(self):
         """ Returns the nodes as a primitive ordered list
+
+        Way nodes prefetched along with their node are used, if any.
+
+        :return: a list of (osmid, lat, lon) tuples
         """
-        return self.nodes.values_list('osmid', 'lat', 'lon')
+        if 'waynode_set' in getattr(self, '_prefetched_objects_cache', {}):
+            way_nodes = self.waynode_set.all()
+        else:
+            way_nodes = self.waynode_set.select_related('node')
+        return [
+            (way_node.node.osmid, way_node.node.lat, way_node.node.lon)
+            for way_node in sorted(way_nodes, key=attrgetter('order'))]
 
 class WayNode(models.Model):
     way = models.ForeignKey(Way, on_delete=models.CASCADE)
@@ -137,7 +212,7 @@ class WayNode(models.Model):
 
 
 class Relation(OSMElement):
-    pass
+    ELEMENT_TYPE = OSMElement.RELATION
     # members = models.ManyToManyField(
     #     OSMElement, through='RelationMember', related_name='parent_relation')
 
@@ -156,6 +231,12 @@ class Action(models.Model):
     DELETE = 'delete'
     REMOVE = 'remove'
 
+    # For select_related(), fetching the elements as their subclass
+    ELEMENTS_SELECT_RELATED = [
+        '{}__{}'.format(version, element_type)
+        for version in ('old', 'new')
+        for element_type in OSMElement.SUBTYPES]
+
     type = models.CharField(
         max_length=10, choices=(
             (REMOVE, REMOVE),
@@ -170,9 +251,40 @@ class Action(models.Model):
         OSMElement,
         related_name='old_for', null=True, on_delete=models.PROTECT)
 
+    # See make_fingerprint()
+    fingerprint = models.CharField(max_length=64, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # See filters.AbstractIgnoreMatchingElements
+            models.Index(fields=['type', 'new'], name='osmdata_action_type_new'),
+        ]
+
+    @staticmethod
+    def make_fingerprint(action_xml):
+        """ Identifies an action across imports
+
+        The same element change can be reported by several adiffs
+        (overlapping queries, retried downloads…), with the same content.
+        Versions are not enough: a way or relation modify keeps them when
+        only its nodes moved.
+
+        :param action_xml: the <action> node, as XML
+        :return: its sha256, as hex
+        """
+        return hashlib.sha256(action_xml.encode('utf-8')).hexdigest()
+
 class Diff(models.Model):
     actions = models.ManyToManyField(Action)
     import_date = models.DateTimeField(auto_now_add=True)
+    # sha256 of the imported file
+    fingerprint = models.CharField(max_length=64, blank=True, db_index=True)
+
+    # Import progress, allowing to resume an interrupted import
+    source_path = models.CharField(max_length=1024, blank=True)
+    checkpoint = models.PositiveIntegerField(
+        default=0, help_text='number of actions imported so far')
+    is_complete = models.BooleanField(default=True)
 
     def __str__(self):
         return 'Diff #{}'.format(self.pk)
@@ -1,11 +1,14 @@
 import datetime
+from itertools import islice
 import xml.dom.minidom
+from xml.dom import pulldom
 
 import pytz
 
 from .models import (
     Action, Bounds, Diff, Node, OSMElement, Relation,
     RelationMember, Tag, Way, WayNode)
+from .stores import ObjectStore
 
 
 class FileFormatError(Exception):
@@ -34,9 +37,15 @@ class AbstractXMLParser:
     # See at the end of the file for definition of :
     # PARSER_MAP = {...}
 
-    def __init__(self, node):
+    def __init__(self, node, store=None):
+        """
+        :param node: the XML node to parse
+        :param store: the ObjectStore receiving the parsed objects, shared
+          with the sub-parsers. Defaults to creating each object in db right
+          away.
+        """
         self.node = node
-
+        self.store = store or ObjectStore()
 
     @staticmethod
     def _dict_fetch(_dict, str_name):
@@ -61,7 +70,7 @@ class AbstractXMLParser:
         :return: the db object.
         """
         klass = self.get_parser(node.localName)
-        return klass(node).parse()
+        return klass(node, store=self.store).parse()
 
     def parse(self):
         """ Parse the XML node and retuns a model instance
@@ -77,8 +86,8 @@ class AbstractXMLParser:
 class RelationMemberParser(AbstractXMLParser):
     """ <member> parser
     """
-    def __init__(self, node, relation, order):
-        self.node = node
+    def __init__(self, node, relation, order, store=None):
+        super().__init__(node, store)
         self.relation = relation
         self.order = order
 
@@ -86,10 +95,11 @@ class RelationMemberParser(AbstractXMLParser):
         _type = self.node.attributes['type'].value
 
         ParserClass = self.get_parser(_type)
-        parser = ParserClass(self.node)
+        parser = ParserClass(self.node, store=self.store)
         element = parser.parse()
 
-        return RelationMember.objects.create(
+        return self.store.create(
+            RelationMember,
             relation=self.relation,
             element=element,
             order=self.order,
@@ -101,7 +111,7 @@ class BoundsParser(AbstractXMLParser):
 
     def parse(self):
         attrs = {k:self.node.attributes[k].value for k in self.BOUNDS_ATTRS}
-        return Bounds.objects.create(**attrs)
+        return self.store.create(Bounds, **attrs)
 
 
 class AbstractOSMElementParser(AbstractXMLParser):
@@ -122,7 +132,8 @@ class AbstractOSMElementParser(AbstractXMLParser):
         """
         tags = []
         for tag_el in self.node.getElementsByTagName('tag'):
-            tags.append(Tag.objects.create(
+            tags.append(self.store.create(
+                Tag,
                 element=element,
                 k=tag_el.attributes['k'].value,
                 v=tag_el.attributes['v'].value,
@@ -138,7 +149,7 @@ class AbstractOSMElementParser(AbstractXMLParser):
         except IndexError:
             pass  # optional
         else:
-            parser = BoundsParser(bounds_tag)
+            parser = BoundsParser(bounds_tag, store=self.store)
             return parser.parse()
 
     def get_basic_attributes(self):
@@ -176,12 +187,14 @@ class RelationParser(AbstractOSMElementParser):
     """
 
     def parse(self):
-        relation =  Relation.objects.create(
+        relation = self.store.create(
+            Relation,
             bounds=self.parse_bounds(),
             **self.get_basic_attributes())
 
         for index, node in enumerate(self.node.getElementsByTagName('member')):
-            member_parser = RelationMemberParser(node, relation, index)
+            member_parser = RelationMemberParser(
+                node, relation, index, store=self.store)
             member_parser.parse()
         self.parse_tags(relation)
         return relation
@@ -191,11 +204,19 @@ class NodeParser(AbstractOSMElementParser):
     """ <node>, <nd> or <member type="node"> parser
     """
 
+    def get_identity_key(self):
+        """ Key under which identical nodes can be shared within an import
+        """
+        return tuple(
+            self.node.getAttribute(i) or None
+            for i in ('ref', 'version', 'lat', 'lon'))
+
     def parse(self):
         lat = self.node.getAttribute('lat') or None
         lon = self.node.getAttribute('lon') or None
 
-        node = Node.objects.create(
+        node = self.store.create(
+            Node,
             lat=lat,
             lon=lon,
             **self.get_basic_attributes())
@@ -207,15 +228,18 @@ class WayParser(AbstractOSMElementParser):
     """
 
     def parse(self):
-        way = Way.objects.create(
+        way = self.store.create(
+            Way,
             bounds=self.parse_bounds(),
             **self.get_basic_attributes())
 
         for index, nd in enumerate(self.node.getElementsByTagName('nd')):
-
-            parser = NodeParser(nd)
-            node = parser.parse()
-            WayNode.objects.create(way=way, node=node, order=index)
+            # The same node is often referenced by several ways or way
+            # versions: store it only once.
+            parser = NodeParser(nd, store=self.store)
+            node = self.store.get_shared(
+                parser.get_identity_key(), parser.parse)
+            self.store.create(WayNode, way=way, node=node, order=index)
         self.parse_tags(way)
         return way
 
@@ -239,6 +263,13 @@ class ActionParser(AbstractXMLParser):
                 raise FileFormatError('There must be a {} tag'.format(i))
             yield getFirstNontextChild(tag)
 
+    def get_fingerprint(self):
+        """ Computes the action fingerprint without parsing it
+
+        See Action.make_fingerprint()
+        """
+        return Action.make_fingerprint(self.node.toxml())
+
     def parse(self):
         new, old = None, None
 
@@ -263,21 +294,116 @@ class ActionParser(AbstractXMLParser):
             raise FileFormatError("{} is an unknown action type".format(
                 action_type))
 
-        return Action.objects.create(
-            new=new, old=old, type=action_type)
+        return self.store.create(
+            Action, new=new, old=old, type=action_type,
+            fingerprint=self.get_fingerprint())
 
 
 class AdiffParser(AbstractXMLParser):
-    def parse(self):
+    """ <osm> parser
+
+    Works on a fully loaded DOM, see StreamingAdiffParser for big files.
+    """
+    # Number of actions linked to the diff at once
+    ACTIONS_CHUNK_SIZE = 500
+
+    def __init__(self, node, store=None):
+        super().__init__(node, store)
+        # Fingerprints of the actions linked to the diff, see parse_actions()
+        self.linked_fingerprints = set()
+
+    def check_root(self):
         if self.node.tagName != 'osm':
             raise FileFormatError('That does not look like an adiff file…')
 
-        diff = Diff.objects.create()
+    def iter_action_nodes(self, skip=0):
+        """
+        :param skip: number of leading <action> nodes to leave out
+        """
+        return self.node.getElementsByTagName('action')[skip:]
+
+    def parse_actions(self, diff, action_nodes, deduplicate=False):
+        """ Parses <action> nodes and links them to the diff
+
+        :param deduplicate: link the actions already known (in db, or
+          earlier in the diff), recognized by their fingerprint, instead of
+          parsing them again. Each action is linked only once to the diff.
+        :return: the number of <action> nodes read
+        """
+        # Link actions by chunks rather than keeping them all in memory
+        count = 0
+        action_nodes = iter(action_nodes)
+        while True:
+            chunk = list(islice(action_nodes, self.ACTIONS_CHUNK_SIZE))
+            if not chunk:
+                break
+            count += len(chunk)
+            if deduplicate:
+                actions = self._parse_unknown_actions(diff, chunk)
+            else:
+                actions = [
+                    ActionParser(node, store=self.store).parse()
+                    for node in chunk]
+            self.store.add_related(diff.actions, actions)
+
+        self.store.flush()
+        return count
+
+    def _parse_unknown_actions(self, diff, action_nodes):
+        """ Gives the actions to link to the diff, parsing unknown ones only
+        """
+        parsers = [ActionParser(node, store=self.store) for node in action_nodes]
+        fingerprints = [parser.get_fingerprint() for parser in parsers]
+
+        known = self.store.get_existing(Action, 'fingerprint', fingerprints)
+        if known:
+            # When resuming, some may be linked already
+            self.linked_fingerprints.update(diff.actions.filter(
+                pk__in=[action.pk for action in known.values()],
+            ).values_list('fingerprint', flat=True))
 
         actions = []
-        for action in self.node.getElementsByTagName("action"):
-            action_parser = ActionParser(action)
-            actions.append(action_parser.parse())
+        for parser, fingerprint in zip(parsers, fingerprints):
+            if fingerprint not in self.linked_fingerprints:
+                self.linked_fingerprints.add(fingerprint)
+                action = known.get(fingerprint)
+                actions.append(action if action else parser.parse())
+        return actions
 
-        diff.actions.set(actions)
+    def parse(self):
+        self.check_root()
+        diff = self.store.create(Diff)
+        self.parse_actions(diff, self.iter_action_nodes())
         return diff
+
+
+class StreamingAdiffParser(AdiffParser):
+    """ <osm> parser reading the adiff incrementally
+
+    Only one <action> DOM subtree is built at a time, and dropped once parsed,
+    so that memory usage does not depend on the adiff size.
+    """
+    def __init__(self, stream, store=None):
+        """
+        :param stream: a file path or a binary file object
+        :param store: see AbstractXMLParser
+        """
+        self.events = pulldom.parse(stream)
+        super().__init__(self._read_root(), store)
+
+    def _read_root(self):
+        for event, node in self.events:
+            if event == pulldom.START_ELEMENT:
+                return node
+        raise FileFormatError('That does not look like an adiff file…')
+
+    def iter_action_nodes(self, skip=0):
+        for event, node in self.events:
+            if event == pulldom.START_ELEMENT and node.tagName == 'action':
+                if skip:
+                    # Left unexpanded: its content events just flow by
+                    skip -= 1
+                    continue
+                # Builds the DOM of that <action> only, not attached to <osm>
+                self.events.expandNode(node)
+                yield node
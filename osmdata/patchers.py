@@ -6,7 +6,11 @@ They thus may modify the data they work on.
 For convenience, the interface is given in AbstractPatcher class.
 """
 
-from osmdata.models import Action, Relation
+from collections import defaultdict
+
+from django.db.models import OuterRef, Q, Subquery
+
+from osmdata.models import Action, Diff, OSMElement, RelationMember
 
 
 class AbstractPatcher:
@@ -19,6 +23,13 @@ class AbstractPatcher:
         """
         raise NotImplementedError
 
+    def patch_in_memory(self, actions):
+        """ Same as patch(), on in-memory actions (see osmdata.memory)
+
+        :param actions: the actions of a diff
+        """
+        raise NotImplementedError
+
 
 class FixRemoveOperationMetadata(AbstractPatcher):
     """
@@ -29,39 +40,104 @@ class FixRemoveOperationMetadata(AbstractPatcher):
 
     description = "Fix Remove operation metadata attribution"
 
-    def _find_previously_owning_relation(self, qs, remove_action):
-        """Heuristic to get the relation previously owning the element
-
-        The old version is removed
-        """
-        # We look only into the same diff
-        same_diff_relations = Relation.objects.filter(
-            old_for__diff=remove_action.diff_set.first())
+    # Number of values per IN clause, below SQLite variables limit
+    CHUNK_SIZE = 500
 
-        try:
-            # The relation that previously contained our element
-            return same_diff_relations.get(
-                members__element__osmid=remove_action.old.osmid)
-        except (Relation.DoesNotExist, Relation.MultipleObjectsReturned):
-            return None
+    def _find_owning_relations_new_versions(self, removes):
+        """Heuristic to get the relations previously owning removed elements
 
-    def patch(self, qs):
-        remove_actions = qs.filter(type=Action.REMOVE).select_related('report')
+        A relation is elected if it is the old version of an action of the
+        same diff, and is the only one having the removed element as
+        member (only once).
 
-        for action in remove_actions:
-            relation = self._find_previously_owning_relation(qs, action)
-            if relation:
-                # Heuristic worked !
-                relation_new_version = relation.old_for.new
+        :param removes: (diff pk, removed element osmid) couples
+        :return: the new version pk of the elected relations, by couple
+        :rtype: dict
+        """
+        diff_pks = {diff_pk for diff_pk, osmid in removes}
+        osmids = sorted({osmid for diff_pk, osmid in removes})
+
+        same_diff = Q(relation__old_for__diff__in=diff_pks - {None})
+        if None in diff_pks:
+            same_diff |= Q(relation__old_for__diff__isnull=True)
+
+        owners = defaultdict(list)
+        for i in range(0, len(osmids), self.CHUNK_SIZE):
+            members = RelationMember.objects.filter(
+                same_diff, element__osmid__in=osmids[i:i + self.CHUNK_SIZE],
+            ).values_list(
+                'relation__old_for__diff', 'element__osmid',
+                'relation__old_for__new')
+            for diff_pk, osmid, new_pk in members:
+                owners[diff_pk, osmid].append(new_pk)
+
+        return {
+            key: new_pks[0] for key, new_pks in owners.items()
+            if len(new_pks) == 1}
 
-                # Actual patching : copy metadata from the changeset which
+    def patch(self, qs):
+        # Each action is looked up within its first diff (not qs one, if qs
+        # is the actions of a diff)
+        first_diff = Diff.actions.through.objects.filter(
+            action=OuterRef('pk'),
+        ).order_by('diff').values('diff')[:1]
+        remove_actions = list(qs.filter(type=Action.REMOVE).annotate(
+            first_diff=Subquery(first_diff),
+        ).values_list('new', 'first_diff', 'old__osmid'))
+
+        relations = self._find_owning_relations_new_versions(
+            {(diff_pk, osmid) for _, diff_pk, osmid in remove_actions})
+        relations_metadata = {}
+        relations_pks = list(set(relations.values()))
+        for i in range(0, len(relations_pks), self.CHUNK_SIZE):
+            relations_metadata.update(
+                (pk, (changeset, timestamp, user))
+                for pk, changeset, timestamp, user in OSMElement.objects.filter(
+                    pk__in=relations_pks[i:i + self.CHUNK_SIZE],
+                ).values_list('pk', 'changeset', 'timestamp', 'user'))
+
+        # Elements to update, by metadata, so that there are few updates
+        patched = defaultdict(list)
+        for new_pk, diff_pk, osmid in remove_actions:
+            relation_pk = relations.get((diff_pk, osmid))
+            if relation_pk:
+                # Heuristic worked ! Copy metadata from the changeset which
                 # removed the element from the relation
+                metadata = relations_metadata[relation_pk]
+            else:
+                # Empty the metadata than keeping misleading metadata
+                metadata = (None, None, '')
+            patched[metadata].append(new_pk)
+
+        for (changeset, timestamp, user), pks in patched.items():
+            for i in range(0, len(pks), self.CHUNK_SIZE):
+                OSMElement.objects.filter(
+                    pk__in=pks[i:i + self.CHUNK_SIZE],
+                ).update(changeset=changeset, timestamp=timestamp, user=user)
+
+    def patch_in_memory(self, actions):
+        # Relations of the diff, with the action they are the old version of
+        old_relations = [
+            (action.old, action) for action in actions
+            if action.old and action.old.type() == OSMElement.RELATION]
+
+        for action in actions:
+            if action.type != Action.REMOVE:
+                continue
+
+            # Same heuristic as _find_owning_relations_new_versions()
+            owning_actions = [
+                relation_action
+                for relation, relation_action in old_relations
+                for member in relation.members
+                if member.element.osmid == action.old.osmid]
+
+            if len(owning_actions) == 1:
+                relation_new_version = owning_actions[0].new
                 action.new.changeset = relation_new_version.changeset
                 action.new.timestamp = relation_new_version.timestamp
                 action.new.user = relation_new_version.user
             else:
-                # Empty the metadata than keeping misleading metadata
                 action.new.changeset = None
                 action.new.timestamp = None
                 action.new.user = ''
-            action.new.save()
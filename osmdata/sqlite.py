@@ -0,0 +1,85 @@
+""" SQLite specific tuning
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+
+# Those pragmas cannot be changed within a transaction
+NON_TRANSACTIONAL_PRAGMAS = ('journal_mode', 'synchronous')
+
+
+def _read_pragma(cursor, name):
+    cursor.execute('PRAGMA {}'.format(name))
+    return cursor.fetchone()[0]
+
+
+def _set_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+@contextmanager
+def bulk_import_profile(using=DEFAULT_DB_ALIAS):
+    """ Tunes the SQLite connection for bulk writes, for the block duration
+
+    Applies settings.SQLITE_BULK_IMPORT_PRAGMAS, and restores the previous
+    values on exit. Does nothing on other databases.
+
+    Pragmas which cannot be changed within a transaction (journal_mode,
+    synchronous) are left untouched when entered in a transaction.
+
+    Connections opened within the block, if the connection gets closed, are
+    tuned as well.
+
+    :param using: the database alias
+    """
+    connection = connections[using]
+    pragmas = settings.SQLITE_BULK_IMPORT_PRAGMAS
+
+    if connection.vendor != 'sqlite' or not pragmas:
+        yield
+        return
+
+    if connection.in_atomic_block:
+        pragmas = {k: v for k, v in pragmas.items()
+                   if k not in NON_TRANSACTIONAL_PRAGMAS}
+
+    def apply_to_new_connection(sender, connection, **kwargs):
+        # Pragmas are lost with the connection, which may get closed within
+        # the block (ex: before ParallelAdiffImporter forks its workers)
+        if connection.alias == using:
+            with connection.cursor() as cursor:
+                _set_pragmas(cursor, pragmas)
+
+    with connection.cursor() as cursor:
+        previous = {name: _read_pragma(cursor, name) for name in pragmas}
+        _set_pragmas(cursor, pragmas)
+    connection_created.connect(apply_to_new_connection, weak=False)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(apply_to_new_connection)
+        with connection.cursor() as cursor:
+            _set_pragmas(cursor, previous)
+
+
+def explain_query_plan(qs):
+    """ SQLite query plan of a queryset
+
+    :return: the plan lines, indented according to the plan tree
+    :rtype: list of str
+    """
+    sql, params = qs.query.sql_with_params()
+    with connections[qs.db].cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        rows = cursor.fetchall()
+
+    # Rows are (id, parent id, unused, detail) tuples
+    depths = {}
+    lines = []
+    for row in rows:
+        depths[row[0]] = depths.get(row[1], -1) + 1
+        lines.append('  ' * depths[row[0]] + row[-1])
+    return lines
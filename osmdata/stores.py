@@ -0,0 +1,319 @@
+""" Object stores
+
+Parsers hand the objects they build to a store, which decides how and when
+they get written to database.
+
+For convenience, the interface is given in ObjectStore class, which is also
+the simplest implementation.
+"""
+from collections import OrderedDict, defaultdict
+
+from django.apps import apps
+from django.db import connections, router
+from django.db.models import Max
+
+from .models import (
+    Action, Bounds, Diff, Node, OSMElement, Relation, RelationMember, Tag,
+    Way, WayNode)
+
+
+class ObjectStore:
+    """ Writes each object to database as soon as it is created
+
+    Also holds an identity map, allowing parsers to share objects appearing
+    several times in the same import (ex: the nodes of a way).
+    """
+    # Beyond that number of shared objects, least recently used are forgotten
+    SHARED_OBJECTS_MAX = 100000
+
+    def __init__(self):
+        self.shared_objects = OrderedDict()
+
+    def get_shared(self, key, create):
+        """ Returns the object registered under key, creating it if required
+
+        :param key: a hashable identifying the object
+        :param create: a callable returning the object, called on cache miss
+        """
+        try:
+            obj = self.shared_objects[key]
+        except KeyError:
+            obj = self.shared_objects[key] = create()
+            if len(self.shared_objects) > self.SHARED_OBJECTS_MAX:
+                self.shared_objects.popitem(last=False)
+        else:
+            self.shared_objects.move_to_end(key)
+        return obj
+
+    def get_existing(self, model, field_name, values):
+        """ Fetches the objects already in database having one of the values
+
+        :param model: the model class
+        :param field_name: the name of a (preferably indexed) field
+        :param values: the values to look for
+        :return: the objects, by value (any of them, if several objects
+          share the same value)
+        :rtype: dict
+        """
+        return {
+            getattr(obj, field_name): obj
+            for obj in model.objects.filter(**{
+                '{}__in'.format(field_name): set(values)})}
+
+    def create(self, model, **kwargs):
+        """ Creates a model instance
+
+        :param model: the model class
+        :param kwargs: field values
+        :return: the model instance, with its pk set
+        """
+        return model.objects.create(**kwargs)
+
+    def add_related(self, manager, objs):
+        """ Adds objects to a many-to-many relationship
+
+        :param manager: the many-to-many manager (ex: ``diff.actions``)
+        :param objs: the model instances to add
+        """
+        manager.add(*objs)
+
+    def flush(self):
+        """ Makes sure every object created so far is written to database
+        """
+        pass
+
+    def end_transaction(self):
+        """ Tells the store the objects written so far are committed
+
+        Following objects will be written in another transaction.
+        """
+        pass
+
+
+class PkAllocator:
+    """ Hands out primary keys for objects that are not saved yet
+
+    SQLite cannot tell the ids of bulk-inserted rows, so we pick them ourselves,
+    above the highest existing one. That assumes nobody else inserts rows in
+    the same tables meanwhile, which holds within a transaction on SQLite.
+    """
+    def __init__(self, query_db=True):
+        """
+        :param query_db: if False, pks start from 1, without any db access
+          (provisional pks, see RowCollectorStore)
+        """
+        self.query_db = query_db
+        self.last_pks = {}
+
+    @staticmethod
+    def root_model(model):
+        """ Model owning the pk sequence (the topmost parent, if any)
+        """
+        parents = model._meta.get_parent_list()
+        return parents[-1] if parents else model
+
+    def reserve(self, model, count):
+        """ Reserves a range of pks
+
+        :return: the offset, reserved pks being offset+1 to offset+count
+        """
+        root = self.root_model(model)
+        if root not in self.last_pks:
+            if self.query_db:
+                self.last_pks[root] = root._base_manager.aggregate(
+                    max_pk=Max('pk'))['max_pk'] or 0
+            else:
+                self.last_pks[root] = 0
+        offset = self.last_pks[root]
+        self.last_pks[root] += count
+        return offset
+
+    def allocate(self, obj):
+        """ Sets the pk of a model instance (and of its parents, if any)
+        """
+        pk = self.reserve(obj.__class__, 1) + 1
+
+        obj.pk = pk
+        for parent in obj._meta.get_parent_list():
+            setattr(obj, parent._meta.pk.attname, pk)
+        return pk
+
+    def reset(self):
+        """ Forget allocated pks, next allocations will query db again
+        """
+        self.last_pks = {}
+
+
+class BulkObjectStore(ObjectStore):
+    """ Collects created objects and writes them by batches
+
+    Each batch costs a few INSERT queries per table, instead of one per row.
+    Objects returned by create() are not written until flush() is called
+    (which happens automatically every `batch_size` objects), so that store
+    is meant to be used within a transaction.
+    """
+    # Models other rows point to, their pk is set as soon as created
+    REFERENCED_MODELS = (Bounds, OSMElement, Action, Diff)
+
+    # Insertion order, referenced tables first
+    MODELS_ORDER = (
+        Bounds, Node, Way, Relation, Tag, WayNode, RelationMember,
+        Action, Diff, Diff.actions.through)
+
+    def __init__(self, batch_size=1000):
+        """
+        :param batch_size: number of objects to collect before writing them,
+          None to write only on explicit flush()
+        """
+        super().__init__()
+        self.batch_size = batch_size or None
+        self.pks = PkAllocator()
+        self.pending = defaultdict(list)
+        self.pending_count = 0
+
+    def create(self, model, **kwargs):
+        obj = model(**kwargs)
+
+        if issubclass(model, self.REFERENCED_MODELS):
+            self.pks.allocate(obj)
+
+        self.pending[model].append(obj)
+        self.pending_count += 1
+        if self.batch_size and self.pending_count >= self.batch_size:
+            self.flush()
+        return obj
+
+    def add_related(self, manager, objs):
+        for obj in objs:
+            self.create(manager.through, **{
+                manager.source_field_name: manager.instance,
+                manager.target_field_name: obj,
+            })
+
+    def flush(self):
+        # Projected coordinates are computed for the whole batch at once
+        Node.update_latlon_batch(self.pending[Node])
+
+        for model in self.MODELS_ORDER:
+            objs = self.pending.pop(model, [])
+            if objs:
+                self._insert(model, objs)
+        self.pending_count = 0
+
+    def end_transaction(self):
+        # Other writers may have inserted rows between transactions
+        self.pks.reset()
+
+    def write_rows(self, rows):
+        """ Writes the rows collected by a RowCollectorStore
+
+        Provisional pks of the rows (and foreign keys pointing to them) are
+        shifted above the pks existing in db.
+
+        :param rows: see RowCollectorStore.get_rows()
+        :return: the created model instances, by model
+        :rtype: dict
+        """
+        models_rows = [(apps.get_model(label), i) for label, i in rows]
+
+        # Reserve as many pks as provisional ones, for each pk sequence
+        provisional_counts = defaultdict(int)
+        for model, model_rows in models_rows:
+            if issubclass(model, self.REFERENCED_MODELS):
+                root = self.pks.root_model(model)
+                provisional_counts[root] = max(
+                    [provisional_counts[root]] +
+                    [row[model._meta.pk.attname] for row in model_rows])
+        offsets = {
+            root: self.pks.reserve(root, count)
+            for root, count in provisional_counts.items()}
+
+        created = {}
+        for model, model_rows in models_rows:
+            shifted_fields = []
+            for field in model._meta.concrete_fields:
+                if field.is_relation:
+                    target = self.pks.root_model(field.related_model)
+                elif field.primary_key:
+                    target = self.pks.root_model(field.model)
+                else:
+                    continue
+                if target in offsets:
+                    shifted_fields.append((field.attname, offsets[target]))
+
+            objs = []
+            for row in model_rows:
+                for attname, offset in shifted_fields:
+                    if row[attname] is not None:
+                        row[attname] += offset
+                objs.append(model(**row))
+            self.pending[model].extend(objs)
+            created[model] = objs
+
+        self.flush()
+        return created
+
+    def _insert(self, model, objs):
+        parents = model._meta.get_parent_list()
+        if parents:
+            # Multi-table inheritance, not handled by bulk_create() : insert
+            # in each table, topmost parent first.
+            db = router.db_for_write(model)
+            for table_model in list(reversed(parents)) + [model]:
+                self._insert_table(
+                    table_model, objs,
+                    table_model._meta.local_concrete_fields, db)
+            for obj in objs:
+                obj._state.adding = False
+                obj._state.db = db
+        else:
+            model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def _insert_table(self, model, objs, fields, db):
+        """ Inserts the given fields of objs into the model table only
+        """
+        batch_size = connections[db].ops.bulk_batch_size(fields, objs)
+        if self.batch_size:
+            batch_size = min(self.batch_size, batch_size)
+        batch_size = max(batch_size, 1)
+        for i in range(0, len(objs), batch_size):
+            model._base_manager._insert(
+                objs[i:i + batch_size], fields=fields, using=db)
+
+
+class RowCollectorStore(BulkObjectStore):
+    """ Collects objects as plain rows, without any database access
+
+    Allows parsing in a process and writing from another one: rows carry
+    provisional pks, and are written with BulkObjectStore.write_rows().
+    """
+    def __init__(self):
+        super().__init__(batch_size=None)
+        self.pks = PkAllocator(query_db=False)
+
+    def get_existing(self, model, field_name, values):
+        # No database access
+        return {}
+
+    def flush(self):
+        # Everything is kept for get_rows()
+        pass
+
+    def get_rows(self):
+        """ Returns every object created so far as plain data
+
+        :return: (model label, rows) couples, in insertion order, each row
+          being a dict of field values.
+        :rtype: list
+        """
+        Node.update_latlon_batch(self.pending[Node])
+
+        rows = []
+        for model in self.MODELS_ORDER:
+            objs = self.pending.get(model)
+            if objs:
+                fields = model._meta.concrete_fields
+                rows.append((model._meta.label, [
+                    {f.attname: getattr(obj, f.attname) for f in fields}
+                    for obj in objs]))
+        return rows
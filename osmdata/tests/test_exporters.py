@@ -1,7 +1,15 @@
+import io
+
+from django.core.management import call_command
+from django.db import connection
+from django.template.loader import render_to_string
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-from ..exporters import AdiffExporter, CSVExporter
-from ..models import Action
+from ..exporters import AdiffExporter, AdiffWriter, CSVExporter
+from ..importers import AdiffImporter
+from ..models import Action, Diff, Tag
+from .utils import get_test_file_path
 
 class ExporterTests(TestCase):
     fixtures = ['test_filters.json'] #  Versailles Chantier
@@ -17,6 +25,16 @@ class ExporterTests(TestCase):
         self.assertEqual(out.count('<old>'), 1)
         self.assertEqual(out.count('<new>'), 1)
 
+    def test_adiff_write_same_as_template(self):
+        diff = Diff.objects.create()
+        diff.actions.add(*Action.objects.all())
+
+        out = io.StringIO()
+        AdiffExporter().write(diff.actions, out)
+        self.assertEqual(
+            out.getvalue(),
+            render_to_string('osmdata/adiff/diff_detail.xml', {'diff': diff}))
+
     def test_csv_export(self):
         """Rough test"""
         exporter = CSVExporter()
@@ -31,3 +49,96 @@ class ExporterTests(TestCase):
         self.assertEqual(
             line1,
             '3497428295,6,2016-09-10 14:41:56+00:00,42060502,Eunjeung Yu,4540825,modify,node')
+
+
+class ExporterQueriesTests(TestCase):
+    def setUp(self):
+        path = get_test_file_path('multiple_actions.osm')
+        self.diff = AdiffImporter(deduplicate=False).run(path)
+        AdiffImporter(deduplicate=False).run(path)
+
+    def count_queries(self, exporter, actions_qs):
+        with CaptureQueriesContext(connection) as queries:
+            exporter.run(actions_qs)
+        return len(queries)
+
+    def test_adiff_same_as_template(self):
+        self.assertEqual(
+            AdiffExporter().run(self.diff.actions),
+            render_to_string(
+                'osmdata/adiff/diff_detail.xml', {'diff': self.diff}))
+
+    def test_queries_count_independent_of_actions_count(self):
+        for exporter in (AdiffExporter(), CSVExporter()):
+            self.assertEqual(
+                self.count_queries(exporter, self.diff.actions),
+                self.count_queries(exporter, Action.objects.all()))
+
+    def test_queries_count_by_chunk(self):
+        exporter = AdiffExporter()
+        one_chunk_count = self.count_queries(exporter, Action.objects.all())
+        exporter.CHUNK_SIZE = 1
+        self.assertGreater(
+            self.count_queries(exporter, Action.objects.all()),
+            one_chunk_count)
+
+    def test_actions_read_by_chunks(self):
+        exporter = CSVExporter()
+        exporter.CHUNK_SIZE = 2
+        with CaptureQueriesContext(connection) as queries:
+            rows = exporter.run(Action.objects.all()).splitlines()[1:]
+        # Actions pks are not read all at once
+        pks_queries = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT "osmdata_action"."id" FROM')]
+        self.assertEqual(len(pks_queries), 4)
+        self.assertTrue(all('LIMIT 2' in sql for sql in pks_queries))
+        self.assertEqual(
+            [row.split(',')[0] for row in rows],
+            [str(i.new.osmid) for i in Action.objects.order_by('pk')])
+
+
+class AdiffWriterTests(TestCase):
+    """ AdiffWriter output conformance to the templates one
+    """
+    def assertSameAsTemplates(self):
+        self.assertEqual(
+            AdiffExporter(native=True).run(Action.objects.all()),
+            AdiffExporter(native=False).run(Action.objects.all()))
+
+    def test_modify_node(self):
+        call_command('loaddata', 'test_filters.json', verbosity=0)
+        self.assertSameAsTemplates()
+
+    def test_ways_and_relations(self):
+        call_command('loaddata', 'test_filters_2.json', verbosity=0)
+        self.assertSameAsTemplates()
+
+    def test_remove(self):
+        call_command('loaddata', 'test_patchers.json', verbosity=0)
+        self.assertSameAsTemplates()
+
+    def test_imported_files(self):
+        for filename in (
+                'create_action.osm', 'delete_action.osm',
+                'multiple_actions.osm'):
+            AdiffImporter(deduplicate=False).run(get_test_file_path(filename))
+        self.assertSameAsTemplates()
+
+    def test_escaping(self):
+        call_command('loaddata', 'test_filters.json', verbosity=0)
+        element = Action.objects.get().new
+        element.user = 'Tom & "Jerry"'
+        element.save()
+        Tag.objects.create(element=element, k='<name>', v="l'église")
+        self.assertSameAsTemplates()
+        self.assertIn(
+            '<tag k="&lt;name&gt;" v="l&#39;église" />',
+            AdiffExporter(native=True).run(Action.objects.all()))
+
+    def test_coordinates_format(self):
+        format_coord = AdiffWriter.format_coord
+        self.assertEqual(format_coord(None), '')
+        self.assertEqual(format_coord(2.0), '2.0000000')
+        self.assertEqual(format_coord(48.123456789), '48.1234568')
+        self.assertEqual(format_coord(-0.00000005), '-0.0000001')
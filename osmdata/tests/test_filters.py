@@ -1,7 +1,7 @@
 from django.test import TestCase
 
 from ..filters import (
-    IgnoreElementsCreation, IgnoreElementsModification,
+    FilterChain, IgnoreElementsCreation, IgnoreElementsModification,
     IgnoreKeys, IgnoreSmallNodeMoves, IgnoreUsers)
 from ..models import Action
 from diffanalysis.models import ActionReport
@@ -10,7 +10,11 @@ from diffanalysis.models import ActionReport
 class AbstractFilterTestcase(TestCase):
     def assertFilterCount(self,_filter, expected_count):
         filtered_qs = _filter.filter(Action.objects)
-        return self.assertEqual(filtered_qs.count(), expected_count)
+        self.assertEqual(filtered_qs.count(), expected_count)
+        # The in-memory counterpart keeps the same actions
+        self.assertEqual(
+            [action for action in Action.objects.all() if _filter.keep(action)],
+            list(filtered_qs.order_by('pk')))
 
 
 class TestIgnoreUsers(AbstractFilterTestcase):
@@ -84,11 +88,32 @@ class TestIgnoredKeys(AbstractFilterTestcase):
     def test_present_tag(self):
         self.assertFilterCount(IgnoreKeys(['name:ko']), 0)
 
+    def test_present_tag_pattern(self):
+        self.assertFilterCount(IgnoreKeys(['shop', 'NAME:.*']), 0)
+        self.assertFilterCount(IgnoreKeys(['name']), 1)
+
+    def test_action_without_report(self):
+        ActionReport.objects.all().delete()
+        self.assertFilterCount(IgnoreKeys([]), 0)
+
+    def test_single_query(self):
+        # Matched in SQL: no query to build it, nor a list of parameters
+        # growing with the touched keys combinations
+        with self.assertNumQueries(0):
+            qs = IgnoreKeys(['shop', 'name:.*']).filter(Action.objects)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(qs), 0)
+
 
 class TestIgnoreSmallNodeMoves(AbstractFilterTestcase):
     fixtures = ['test_geo_filters']
 
+    def make_reports(self):
+        # Moves are computed by the reports
+        ActionReport.objects.create_for_queryset(Action.objects.all())
+
     def test_keep_no_move(self):
+        self.make_reports()
         self.assertFilterCount(
             IgnoreSmallNodeMoves(min_move=100),
             1)
@@ -98,6 +123,7 @@ class TestIgnoreSmallNodeMoves(AbstractFilterTestcase):
         ac.new.node.lat = 48.79869
         ac.new.node.lon = 2.13258
         ac.new.node.save()
+        self.make_reports()
 
         self.assertFilterCount(
             IgnoreSmallNodeMoves(min_move=100),
@@ -110,7 +136,65 @@ class TestIgnoreSmallNodeMoves(AbstractFilterTestcase):
         ac.new.node.lat = 48.79549
         ac.new.node.lon = 2.13560
         ac.new.node.save()
+        self.make_reports()
 
         self.assertFilterCount(
             IgnoreSmallNodeMoves(min_move=100),
             0)
+
+    def test_keep_deleted_node(self):
+        ac = Action.objects.first()
+        ac.new.node.lat = None
+        ac.new.node.lon = None
+        ac.new.node.save()
+        self.make_reports()
+
+        self.assertIsNone(ActionReport.objects.get().node_move)
+        self.assertFilterCount(
+            IgnoreSmallNodeMoves(min_move=100),
+            1)
+
+    def test_no_node_pass(self):
+        self.make_reports()
+        # Neither latlon computation nor distance at filter time
+        with self.assertNumQueries(1):
+            IgnoreSmallNodeMoves(min_move=100).filter(Action.objects).count()
+
+
+class TestFilterChain(AbstractFilterTestcase):
+    fixtures = ['test_filters_2.json']  # Pont Cadinet
+
+    def setUp(self):
+        for action in Action.objects.all():
+            ActionReport.objects.get_or_create_for_action(action)
+
+        self.filters = [
+            IgnoreElementsCreation('access=*'),
+            IgnoreUsers(['foo']),
+            IgnoreKeys(['name']),
+            IgnoreElementsModification('access=*'),
+        ]
+
+    def test_same_as_sequential(self):
+        qs = Action.objects.all()
+        for _filter in self.filters:
+            qs = _filter.filter(qs)
+
+        self.assertEqual(
+            set(FilterChain(self.filters).filter(Action.objects)),
+            set(qs))
+
+    def test_single_query(self):
+        qs = FilterChain(self.filters).filter(Action.objects)
+        self.assertFalse(qs.query.distinct)
+        with self.assertNumQueries(1):
+            list(qs)
+
+    def test_non_mergeable_filter(self):
+        class _NoCreation:
+            def filter(self, qs):
+                return qs.exclude(type=Action.CREATE)
+
+        chain = FilterChain(self.filters[:2] + [_NoCreation()] + self.filters[2:])
+        self.assertFalse(
+            chain.filter(Action.objects).filter(type=Action.CREATE).exists())
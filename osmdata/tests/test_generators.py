@@ -0,0 +1,74 @@
+import io
+import os
+import tempfile
+
+from django.test import TestCase
+
+from ..generators import AdiffGenerator, parse_mix, parse_range
+from ..importers import AdiffImporter
+from ..memory import MemoryStore
+from ..models import Action, OSMElement
+from ..parsers import StreamingAdiffParser
+
+
+def generate(**kwargs):
+    out = io.StringIO()
+    AdiffGenerator(**kwargs).write(out)
+    return out.getvalue()
+
+
+class AdiffGeneratorTests(TestCase):
+    def parse(self, xml):
+        stream = io.BytesIO(xml.encode('utf-8'))
+        return StreamingAdiffParser(stream, store=MemoryStore()).parse()
+
+    def test_actions(self):
+        diff = self.parse(generate(actions=200))
+        self.assertEqual(len(diff.actions), 200)
+        self.assertEqual(
+            {action.type for action in diff.actions},
+            {Action.CREATE, Action.MODIFY, Action.DELETE, Action.REMOVE})
+        self.assertEqual(
+            {(action.old or action.new).type() for action in diff.actions},
+            {OSMElement.NODE, OSMElement.WAY, OSMElement.RELATION})
+
+    def test_mix(self):
+        diff = self.parse(generate(
+            actions=50, action_mix={Action.MODIFY: 1},
+            element_mix={OSMElement.WAY: 1}, way_nodes=(3, 3), tags=(2, 2)))
+        for action in diff.actions:
+            self.assertEqual(action.type, Action.MODIFY)
+            self.assertEqual(action.old.type(), OSMElement.WAY)
+            self.assertEqual(len(action.old.nodes), 3)
+            self.assertEqual(len(action.old.tags), 2)
+            self.assertGreater(action.new.version, action.old.version)
+
+    def test_reproducible(self):
+        self.assertEqual(generate(seed=1), generate(seed=1))
+        self.assertNotEqual(generate(seed=1), generate(seed=2))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            AdiffGenerator(action_mix={'foo': 1})
+        with self.assertRaises(ValueError):
+            AdiffGenerator(tags=(0, 100))
+
+    def test_parse_options(self):
+        self.assertEqual(
+            parse_mix('create=1, modify=2.5'),
+            {'create': 1, 'modify': 2.5})
+        self.assertEqual(parse_range('2:30'), (2, 30))
+        self.assertEqual(parse_range('4'), (4, 4))
+        for spec in ('3:2', 'a:b', '1:2:3'):
+            with self.assertRaises(ValueError):
+                parse_range(spec)
+        with self.assertRaises(ValueError):
+            parse_mix('create')
+
+    def test_import_compressed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'generated.osm.gz')
+            AdiffGenerator(actions=30).write_file(path)
+            diff = AdiffImporter().run(path)
+        # No action got deduplicated
+        self.assertEqual(diff.actions.count(), 30)
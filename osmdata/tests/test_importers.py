@@ -1,9 +1,38 @@
+import bz2
+import gzip
+import lzma
+from operator import attrgetter
 import tempfile
 
 from django.test import TestCase
 
-from ..importers import AdiffImporter, ImporterError
-from .utils import get_test_file_path
+from ..importers import AdiffImporter, ImporterError, ParallelAdiffImporter
+from ..models import Action, Diff
+from .utils import get_test_file_path, parse_test_data
+
+
+def dump_element(element):
+    """ Primitive representation of an element, for comparisons
+    """
+    if element is None:
+        return None
+    dump = [element.type(), element.osmid, element.version, element.user,
+            element.changeset, element.visible, element.tags_dict()]
+    if element.type() == 'way':
+        dump.append(list(element.way.nodes_list()))
+    elif element.type() == 'node':
+        dump.append((element.node.lat, element.node.lon))
+    elif element.type() == 'relation':
+        dump.append([
+            (m.element.type(), m.element.osmid, m.role, m.order)
+            for m in sorted(
+                element.relation.members.all(), key=attrgetter('order'))])
+    return dump
+
+
+def dump_diff(diff):
+    return [(a.type, dump_element(a.old), dump_element(a.new))
+            for a in diff.actions.order_by('pk')]
 
 
 class ImporterTests(TestCase):
@@ -23,6 +52,208 @@ class ImporterTests(TestCase):
         # We barely check there is no error
         self.assertIsNotNone(importer.run(get_test_file_path('create_action.osm')))
 
+    def test_bulk_same_as_unitary(self):
+        for filename in ('create_action.osm', 'modify_action.osm',
+                         'delete_action.osm', 'remove_action.osm'):
+            path = get_test_file_path(filename)
+            bulk_diff = AdiffImporter(
+                batch_size=3, deduplicate=False).run(path)
+            unitary_diff = AdiffImporter(
+                batch_size=0, deduplicate=False).run(path)
+            self.assertEqual(dump_diff(bulk_diff), dump_diff(unitary_diff))
+
+    def test_compressed_files(self):
+        path = get_test_file_path('modify_action.osm')
+        expected = dump_diff(AdiffImporter().run(path))
+
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        for compress in (gzip.compress, bz2.compress, lzma.compress):
+            with tempfile.NamedTemporaryFile() as compressed:
+                compressed.write(compress(content))
+                compressed.flush()
+                diff = AdiffImporter(deduplicate=False).run(compressed.name)
+                self.assertEqual(dump_diff(diff), expected)
+
+    def test_corrupted_compressed_file(self):
+        with open(get_test_file_path('modify_action.osm'), 'rb') as f:
+            self.f.write(gzip.compress(f.read())[:-20])
+        self.f.flush()
+
+        with self.assertRaises(ImporterError):
+            AdiffImporter().run(self.f.name)
+
+    def test_parallel_same_as_sequential(self):
+        paths = [get_test_file_path(i) for i in (
+            'create_action.osm', 'modify_action.osm', 'remove_action.osm')]
+        sequential_diffs = [
+            AdiffImporter(deduplicate=False).run(path) for path in paths]
+        parallel_diffs = list(ParallelAdiffImporter(
+            jobs=2, deduplicate=False).run_many(paths))
+
+        self.assertEqual(
+            [dump_diff(i) for i in parallel_diffs],
+            [dump_diff(i) for i in sequential_diffs])
+
+    def test_parallel_invalid_file(self):
+        importer = ParallelAdiffImporter(jobs=2)
+        with self.assertRaises(ImporterError):
+            list(importer.run_many([
+                get_test_file_path('create_action.osm'),
+                get_test_file_path('invalid_action.osm')]))
+        self.assertEqual(Diff.objects.count(), 1)
+
+    def test_invalid_data_file_rollback(self):
+        with self.assertRaises(ImporterError):
+            AdiffImporter().run(get_test_file_path('invalid_action.osm'))
+        self.assertEqual(Diff.objects.count(), 0)
+
+    def test_checkpoints_same_as_single_transaction(self):
+        path = get_test_file_path('multiple_actions.osm')
+        for batch_size in (0, 3):
+            single_diff = AdiffImporter(
+                batch_size=batch_size, checkpoint_size=0,
+                deduplicate=False).run(path)
+            checkpoints_diff = AdiffImporter(
+                batch_size=batch_size, checkpoint_size=2,
+                deduplicate=False).run(path)
+            self.assertEqual(dump_diff(single_diff), dump_diff(checkpoints_diff))
+            self.assertEqual(checkpoints_diff.checkpoint, 3)
+            self.assertTrue(checkpoints_diff.is_complete)
+
+    def test_resume_interrupted_import(self):
+        path = get_test_file_path('multiple_actions.osm')
+        importer = AdiffImporter(checkpoint_size=1, deduplicate=False)
+        diff = importer.run(path)
+        # As if interrupted after the second checkpoint
+        third_action = diff.actions.order_by('pk').last()
+        diff.actions.remove(third_action)
+        Diff.objects.filter(pk=diff.pk).update(is_complete=False, checkpoint=2)
+        actions_count = Action.objects.count()
+
+        resumed_diff = importer.run(path, resume=True)
+        self.assertEqual(resumed_diff.pk, diff.pk)
+        self.assertTrue(resumed_diff.is_complete)
+        self.assertEqual(resumed_diff.checkpoint, 3)
+        self.assertEqual(Action.objects.count(), actions_count + 1)
+        self.assertEqual(
+            dump_diff(resumed_diff),
+            dump_diff(AdiffImporter(
+                checkpoint_size=0, deduplicate=False).run(path)))
+
+    def test_resume_changed_file(self):
+        path = get_test_file_path('multiple_actions.osm')
+        with open(path) as f:
+            content = f.read()
+        # Third action is broken
+        head, sep, tail = content.rpartition('<action type="delete">')
+        self.f.write((head + '<action type="tralala">' + tail).encode())
+        self.f.flush()
+
+        importer = AdiffImporter(checkpoint_size=1, deduplicate=False)
+        with self.assertRaises(ImporterError):
+            importer.run(self.f.name)
+        diff = Diff.objects.get()
+        self.assertFalse(diff.is_complete)
+        self.assertEqual(diff.checkpoint, 2)
+
+        # File gets replaced: its checkpoint means nothing anymore
+        self.f.seek(0)
+        self.f.write(content.encode())
+        self.f.truncate()
+        self.f.flush()
+
+        new_diff = importer.run(self.f.name, resume=True)
+        self.assertNotEqual(new_diff.pk, diff.pk)
+        self.assertTrue(new_diff.is_complete)
+        self.assertEqual(
+            dump_diff(new_diff),
+            dump_diff(AdiffImporter(
+                checkpoint_size=0, deduplicate=False).run(path)))
+
+    def test_resume_without_interrupted_import(self):
+        path = get_test_file_path('multiple_actions.osm')
+        first_diff = AdiffImporter().run(path)
+        diff = AdiffImporter().run(path, resume=True)
+        self.assertNotEqual(diff.pk, first_diff.pk)
+        self.assertEqual(diff.actions.count(), 3)
+
+    def test_identical_file_not_imported_again(self):
+        path = get_test_file_path('multiple_actions.osm')
+        first_diff = AdiffImporter().run(path)
+        actions_count = Action.objects.count()
+
+        diff = AdiffImporter().run(path)
+        self.assertNotEqual(diff.pk, first_diff.pk)
+        self.assertEqual(diff.fingerprint, first_diff.fingerprint)
+        self.assertEqual(Action.objects.count(), actions_count)
+        self.assertEqual(
+            list(diff.actions.order_by('pk')),
+            list(first_diff.actions.order_by('pk')))
+
+    def test_known_actions_not_imported_again(self):
+        AdiffImporter().run(get_test_file_path('modify_action.osm'))
+        actions_count = Action.objects.count()
+
+        # Contains the same modify action, among 2 others
+        for batch_size in (0, 3):
+            diff = AdiffImporter(batch_size=batch_size).run(
+                get_test_file_path('multiple_actions.osm'))
+            self.assertEqual(diff.actions.count(), 3)
+        self.assertEqual(Action.objects.count(), actions_count + 2)
+
+    def test_fingerprint(self):
+        diff = AdiffImporter().run(get_test_file_path('remove_action.osm'))
+        action_node, = parse_test_data(
+            'remove_action.osm').getElementsByTagName('action')
+        self.assertEqual(
+            diff.actions.get().fingerprint,
+            Action.make_fingerprint(action_node.toxml()))
+
+    def test_same_versions_different_content(self):
+        # Overpass keeps the way versions when only its nodes moved
+        way_modify = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<action type="modify">
+<old>
+  <way id="42" version="3" timestamp="2016-09-29T20:39:04Z" changeset="1" uid="1" user="foo">
+    <nd ref="1" lat="48.8874563" lon="2.3140540"/>
+    <nd ref="2" lat="48.8874414" lon="2.3140648"/>
+  </way>
+</old>
+<new>
+  <way id="42" version="3" timestamp="2016-09-29T20:39:04Z" changeset="1" uid="1" user="foo">
+    <nd ref="1" lat="{}" lon="2.3140540"/>
+    <nd ref="2" lat="48.8874414" lon="2.3140648"/>
+  </way>
+</new>
+</action>
+</osm>"""
+        diffs = []
+        for lat in ('48.8875000', '48.8876000'):
+            self.f.seek(0)
+            self.f.write(way_modify.format(lat).encode())
+            self.f.truncate()
+            self.f.flush()
+            diffs.append(AdiffImporter().run(self.f.name))
+
+        first_action, second_action = [diff.actions.get() for diff in diffs]
+        self.assertNotEqual(first_action.pk, second_action.pk)
+        self.assertNotEqual(
+            first_action.fingerprint, second_action.fingerprint)
+        self.assertEqual(
+            second_action.new.way.waynode_set.get(order=0).node.lat,
+            48.8876)
+
+    def test_parallel_identical_file(self):
+        path = get_test_file_path('modify_action.osm')
+        first_diff = AdiffImporter().run(path)
+        diff, = ParallelAdiffImporter(jobs=2).run_many([path])
+        self.assertEqual(diff.fingerprint, first_diff.fingerprint)
+        self.assertEqual(
+            list(diff.actions.all()), list(first_diff.actions.all()))
+
     def test_open_inexistant_file(self):
         with self.assertRaises(ImporterError):
             importer = AdiffImporter()
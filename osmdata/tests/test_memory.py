@@ -0,0 +1,95 @@
+from django.test import TestCase
+
+from diffanalysis.memory import MemoryActionReport
+from diffanalysis.models import ActionReport
+from ..importers import AdiffImporter
+from ..memory import MemoryDiff, MemoryStore, RelatedList
+from ..models import Action, Diff, Tag
+from ..patchers import FixRemoveOperationMetadata
+from .test_importers import dump_diff, dump_element
+from .utils import get_test_file_path
+
+
+def dump_memory_diff(diff):
+    return [(a.type, dump_element(a.old), dump_element(a.new))
+            for a in diff.actions]
+
+
+class TestRelatedList(TestCase):
+    def test_queryset_like(self):
+        related = RelatedList([1, 2])
+        self.assertIs(related.all(), related)
+        self.assertEqual(list(related.iterator()), [1, 2])
+        self.assertEqual(related.count(), 2)
+        self.assertTrue(related.exists())
+        self.assertFalse(RelatedList().exists())
+
+
+class TestMemoryStore(TestCase):
+    def test_no_db_access(self):
+        with self.assertNumQueries(0):
+            AdiffImporter().run_in_memory(
+                get_test_file_path('multiple_actions.osm'))
+
+    def test_same_as_import(self):
+        for filename in (
+                'create_action.osm', 'modify_action.osm', 'delete_action.osm',
+                'remove_action.osm', 'multiple_actions.osm'):
+            path = get_test_file_path(filename)
+            memory_diff = AdiffImporter().run_in_memory(path)
+            diff = AdiffImporter(deduplicate=False).run(path)
+
+            self.assertIsInstance(memory_diff, MemoryDiff)
+            self.assertEqual(
+                dump_memory_diff(memory_diff), dump_diff(diff), filename)
+
+    def test_field_conversion(self):
+        self.assertEqual(MemoryStore.to_python(Action, 'type', 'create'),
+                         'create')
+        self.assertEqual(MemoryStore.to_python(Tag, 'k', 'name'), 'name')
+        self.assertEqual(MemoryStore.to_python(Diff, 'checkpoint', '3'), 3)
+
+
+class TestMemoryAnalysis(TestCase):
+    def assertSameReports(self, filename):
+        path = get_test_file_path(filename)
+        memory_diff = AdiffImporter().run_in_memory(path)
+        FixRemoveOperationMetadata().patch_in_memory(memory_diff.actions)
+        diff = AdiffImporter(deduplicate=False).run(path)
+        FixRemoveOperationMetadata().patch(diff.actions.all())
+
+        actions = diff.actions.order_by('pk')
+        ActionReport.objects.create_for_queryset(actions)
+        self.assertEqual(
+            dump_memory_diff(memory_diff),
+            [(a.type, dump_element(a.old), dump_element(a.new))
+             for a in actions])
+
+        for memory_action, action in zip(memory_diff.actions, actions):
+            memory_report = MemoryActionReport(memory_action)
+            report = ActionReport.objects.get(action=action)
+            self.assertIs(memory_action.report, memory_report)
+            for field_name in (
+                    'main_tag', 'is_tag_action', 'is_geometric_action',
+                    'version_delta', 'touched_keys', 'node_move'):
+                self.assertEqual(
+                    getattr(memory_report, field_name),
+                    getattr(report, field_name), field_name)
+            for field_name in (
+                    'added_tags', 'removed_tags', 'modified_tags_old',
+                    'modified_tags_new'):
+                self.assertEqual(
+                    sorted(str(tag) for tag in getattr(
+                        memory_report, field_name).all()),
+                    sorted(str(tag) for tag in getattr(
+                        report, field_name).all()),
+                    field_name)
+
+    def test_modify(self):
+        self.assertSameReports('modify_action.osm')
+
+    def test_remove(self):
+        self.assertSameReports('remove_action.osm')
+
+    def test_multiple_actions(self):
+        self.assertSameReports('multiple_actions.osm')
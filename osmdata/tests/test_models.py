@@ -1,5 +1,6 @@
 from django.test import TestCase
 
+from ..geo_utils import planify_coords
 from ..models import Diff, Node, OSMElement, Relation, Tag, Way
 
 class TestTag(TestCase):
@@ -54,6 +55,23 @@ class TestOSMElement(TestCase):
         with self.assertRaises(ValueError):
             non_specialized.specialized()
 
+    def test_element_type(self):
+        way = Way.objects.create(osmid="1234")
+        self.assertEqual(way.element_type, OSMElement.WAY)
+
+        element = OSMElement.objects.get(pk=way.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(element.type(), OSMElement.WAY)
+
+    def test_element_type_missing(self):
+        # ex: loaded from a fixture
+        way = Way.objects.create(osmid="1234")
+        OSMElement.objects.filter(pk=way.pk).update(element_type='')
+
+        element = OSMElement.objects.get(pk=way.pk)
+        self.assertEqual(element.type(), OSMElement.WAY)
+        self.assertEqual(Way.objects.get(pk=way.pk).type(), OSMElement.WAY)
+
     def test_osmelement_as_str(self):
         way = Way.objects.create(osmid="1234")
         self.assertEqual(str(way), '<Way id="1234">')
@@ -63,6 +81,17 @@ class TestOSMElement(TestCase):
         self.assertEqual(int(n.latlon.x), 215859)
         self.assertEqual(int(n.latlon.y), 6247806)
 
+    def test_node_latlon_batch(self):
+        nodes = [Node(lat=48.8403, lon=1.9391), Node(lat=-33.8688, lon=151.2093),
+                 Node(lat=None, lon=None)]
+        Node.update_latlon_batch(nodes)
+
+        for node in nodes[:2]:
+            expected = planify_coords(node.lat, node.lon)
+            self.assertAlmostEqual(node.latlon.x, expected.x, places=3)
+            self.assertAlmostEqual(node.latlon.y, expected.y, places=3)
+            self.assertEqual(node.latlon.srid, 3857)
+        self.assertIsNone(nodes[2].latlon)
 
 
 class DiffTest(TestCase):
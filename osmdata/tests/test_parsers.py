@@ -1,13 +1,17 @@
 import datetime
+import io
 
 from django.test import TestCase
 
 from ..parsers import (
     AbstractXMLParser, ActionParser, AdiffParser, BoundsParser,
-    FileFormatError, RelationParser, NodeParser, WayParser, zulu_tz)
+    FileFormatError, RelationParser, NodeParser, StreamingAdiffParser,
+    WayParser, zulu_tz)
 from ..models import (
     Action, Bounds, Diff, Node, Relation, RelationMember, Way, WayNode)
-from .utils import minidom_parse_fragment, parse_test_data
+from ..stores import ObjectStore
+from .utils import (
+    get_test_file_path, minidom_parse_fragment, parse_test_data)
 
 
 class AdiffParserTest(TestCase):
@@ -25,6 +29,41 @@ class AdiffParserTest(TestCase):
             test_data = minidom_parse_fragment('<h1>lol</h1>')
             AdiffParser(test_data).parse()
 
+
+class StreamingAdiffParserTest(TestCase):
+    def test_streaming_adiff_parser(self):
+        parser = StreamingAdiffParser(get_test_file_path('modify_action.osm'))
+        diff = parser.parse()
+        self.assertIsInstance(diff, Diff)
+        self.assertEqual(diff.actions.count(), 1)
+
+        action = diff.actions.get()
+        self.assertEqual(action.type, Action.MODIFY)
+        self.assertEqual(action.old.tags_dict(), {
+            'name': 'Versailles Chantiers'})
+        self.assertEqual(action.new.tags_dict(), {
+            'name': 'Versailles Chantiers',
+            'wikipedia': 'fr:Gare de Versailles-Chantiers'})
+
+    def test_streaming_same_as_dom(self):
+        path = get_test_file_path('create_action.osm')
+        dom_diff = AdiffParser(
+            parse_test_data('create_action.osm').documentElement).parse()
+        stream_diff = StreamingAdiffParser(path).parse()
+
+        dom_way = dom_diff.actions.get().new.way
+        stream_way = stream_diff.actions.get().new.way
+        self.assertEqual(
+            list(dom_way.nodes_list()), list(stream_way.nodes_list()))
+        self.assertEqual(dom_way.osmid, stream_way.osmid)
+
+    def test_streaming_invalid_root_tag(self):
+        with open(get_test_file_path('create_action.osm'), 'rb') as f:
+            content = f.read().replace(b'<osm ', b'<h1 ').replace(
+                b'</osm>', b'</h1>')
+        with self.assertRaises(FileFormatError):
+            StreamingAdiffParser(io.BytesIO(content)).parse()
+
 class AbstractXMLParserTest(TestCase):
     def test_get_existing_model(self):
         self.assertEqual(AbstractXMLParser.get_parser('node'), NodeParser)
@@ -96,6 +135,35 @@ class OSMElementsParserTest(TestCase):
         self.assertEqual([first_wn.node.osmid, first_wn.order], [4424244203, 0])
         self.assertEqual([second_wn.node.osmid, second_wn.order], [4424244201, 1])
 
+    def test_way_parser_shared_nodes(self):
+        # A closed way references its first node twice
+        element = minidom_parse_fragment("""
+          <way id="444967525" version="1" timestamp="2016-09-29T20:39:04Z" changeset="42528786" uid="677099" user="Yann_L">
+            <nd ref="4424244203" lat="48.8874563" lon="2.3140540"/>
+            <nd ref="4424244201" lat="48.8874414" lon="2.3140648"/>
+            <nd ref="4424244203" lat="48.8874563" lon="2.3140540"/>
+          </way>
+        """)
+        store = ObjectStore()
+        way = WayParser(element, store=store).parse()
+        self.assertEqual(WayNode.objects.filter(way=way).count(), 3)
+        self.assertEqual(Node.objects.count(), 2)
+
+        # Same store (same import) : nodes are shared with the other ways
+        WayParser(element, store=store).parse()
+        self.assertEqual(WayNode.objects.count(), 6)
+        self.assertEqual(Node.objects.count(), 2)
+
+    def test_way_parser_moved_node_not_shared(self):
+        element = minidom_parse_fragment("""
+          <way id="444967525" version="1" timestamp="2016-09-29T20:39:04Z" changeset="42528786" uid="677099" user="Yann_L">
+            <nd ref="4424244203" lat="48.8874563" lon="2.3140540"/>
+            <nd ref="4424244203" lat="48.8874564" lon="2.3140540"/>
+          </way>
+        """)
+        WayParser(element).parse()
+        self.assertEqual(Node.objects.count(), 2)
+
     def test_way__parser_missing_bounds(self):
         # bounds are considered optional
         element = minidom_parse_fragment("""
@@ -4,7 +4,7 @@ from django.test import TestCase
 import pytz
 
 from ..patchers import FixRemoveOperationMetadata
-from osmdata.models import Action
+from osmdata.models import Action, Diff
 
 
 class TestFixRemoveOperationMetadata(TestCase):
@@ -47,3 +47,17 @@ class TestFixRemoveOperationMetadata(TestCase):
         self.assertEqual(remove_action.new.user, '')
         self.assertIsNone(remove_action.new.timestamp)
         self.assertIsNone(remove_action.new.changeset)
+
+    def test_queries_count(self):
+        patcher = FixRemoveOperationMetadata()
+        # Removes, owning relations, their metadata and the update
+        with self.assertNumQueries(4):
+            patcher.patch(Action.objects.all())
+
+    def test_patch_diff_actions(self):
+        patcher = FixRemoveOperationMetadata()
+        patcher.patch(Diff.objects.get().actions.all())
+
+        remove_action = Action.objects.get(type=Action.REMOVE)
+        self.assertEqual(remove_action.new.user, 'johnparis')
+        self.assertEqual(remove_action.new.changeset, 53999449)
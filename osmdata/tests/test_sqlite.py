@@ -0,0 +1,67 @@
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from ..importers import ParallelAdiffImporter
+from ..models import Action, Tag
+from ..sqlite import bulk_import_profile, explain_query_plan
+from .utils import get_test_file_path
+
+
+def read_pragma(name):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA {}'.format(name))
+        return cursor.fetchone()[0]
+
+
+class TestBulkImportProfile(TestCase):
+    @override_settings(SQLITE_BULK_IMPORT_PRAGMAS={'cache_size': -4321})
+    def test_applied_then_restored(self):
+        before = read_pragma('cache_size')
+        with bulk_import_profile():
+            self.assertEqual(read_pragma('cache_size'), -4321)
+        self.assertEqual(read_pragma('cache_size'), before)
+
+    @override_settings(SQLITE_BULK_IMPORT_PRAGMAS={
+        'cache_size': -4321, 'synchronous': 'OFF'})
+    def test_non_transactional_pragmas_skipped(self):
+        # TestCase runs within a transaction
+        before = read_pragma('synchronous')
+        with bulk_import_profile():
+            self.assertEqual(read_pragma('synchronous'), before)
+            self.assertEqual(read_pragma('cache_size'), -4321)
+
+    @override_settings(SQLITE_BULK_IMPORT_PRAGMAS={})
+    def test_disabled(self):
+        before = read_pragma('cache_size')
+        with bulk_import_profile():
+            self.assertEqual(read_pragma('cache_size'), before)
+
+
+class TestBulkImportProfileParallelImport(TransactionTestCase):
+    # Outside of a transaction, connections get closed before forking
+    @override_settings(SQLITE_BULK_IMPORT_PRAGMAS={
+        'cache_size': -4321, 'synchronous': 'OFF'})
+    def test_kept_during_parallel_import(self):
+        paths = [get_test_file_path(i) for i in (
+            'create_action.osm', 'modify_action.osm')]
+        with bulk_import_profile():
+            for diff in ParallelAdiffImporter(jobs=2).run_many(paths):
+                self.assertEqual(read_pragma('cache_size'), -4321)
+                # OFF
+                self.assertEqual(read_pragma('synchronous'), 0)
+
+
+class TestExplainQueryPlan(TestCase):
+    def test_explain(self):
+        lines = explain_query_plan(Action.objects.filter(new__user='foo'))
+        self.assertTrue(lines)
+        self.assertTrue(all(isinstance(line, str) for line in lines))
+
+    def test_filter_indexes_used(self):
+        plan = '\n'.join(explain_query_plan(
+            Tag.objects.filter(k='foo', v='bar').values('element')))
+        self.assertIn('osmdata_tag_k_v_element', plan)
+
+        plan = '\n'.join(explain_query_plan(
+            Action.objects.filter(new__user__in=['foo'])))
+        self.assertIn('osmdata_element_user', plan)
@@ -0,0 +1,121 @@
+from django.db import transaction
+from django.test import TestCase
+
+from ..models import Action, Diff, Node, OSMElement, Tag, Way, WayNode
+from ..stores import (
+    BulkObjectStore, ObjectStore, PkAllocator, RowCollectorStore)
+
+
+class TestObjectStore(TestCase):
+    def test_create(self):
+        node = ObjectStore().create(Node, osmid=12, lat=48.1, lon=2.1)
+        self.assertIsNotNone(node.pk)
+        self.assertEqual(Node.objects.get().osmid, 12)
+
+
+    def test_get_shared(self):
+        store = ObjectStore()
+        store.SHARED_OBJECTS_MAX = 2
+        self.assertEqual(store.get_shared('a', lambda: 1), 1)
+        self.assertEqual(store.get_shared('a', lambda: 2), 1)
+
+        store.get_shared('b', lambda: 3)
+        store.get_shared('a', lambda: 4)  # a is now the most recently used
+        store.get_shared('c', lambda: 5)  # evicts b
+        self.assertEqual(store.get_shared('a', lambda: 6), 1)
+        self.assertEqual(store.get_shared('b', lambda: 7), 7)
+
+
+class TestPkAllocator(TestCase):
+    def test_allocate_after_existing(self):
+        existing = Way.objects.create(osmid=1)
+        allocator = PkAllocator()
+
+        node = Node(osmid=2)
+        allocator.allocate(node)
+        # Pk sequence is shared between OSMElement and its children
+        self.assertEqual(node.pk, existing.pk + 1)
+        self.assertEqual(node.id, node.pk)
+
+        way = Way(osmid=3)
+        allocator.allocate(way)
+        self.assertEqual(way.pk, existing.pk + 2)
+
+
+class TestBulkObjectStore(TestCase):
+    def test_nothing_written_before_flush(self):
+        store = BulkObjectStore(batch_size=100)
+        store.create(Node, osmid=12, lat=48.1, lon=2.1)
+        self.assertEqual(Node.objects.count(), 0)
+
+        store.flush()
+        self.assertEqual(Node.objects.count(), 1)
+        self.assertEqual(OSMElement.objects.count(), 1)
+
+    def test_multi_table_inheritance(self):
+        store = BulkObjectStore()
+        with transaction.atomic():
+            way = store.create(Way, osmid=1)
+            node = store.create(Node, osmid=2, lat='48.1', lon='2.1')
+            store.create(WayNode, way=way, node=node, order=0)
+            store.create(Tag, element=way, k='highway', v='primary')
+            action = store.create(Action, new=way, type=Action.CREATE)
+            store.flush()
+
+        way = Way.objects.get()
+        self.assertEqual(list(way.nodes_list()), [(2, 48.1, 2.1)])
+        self.assertEqual(way.tags_dict(), {'highway': 'primary'})
+        self.assertEqual(Action.objects.get(pk=action.pk).new.way, way)
+        self.assertIsNotNone(Node.objects.get().latlon)
+
+    def test_flush_by_batches(self):
+        store = BulkObjectStore(batch_size=2)
+        with transaction.atomic():
+            store.create(Node, osmid=1)
+            self.assertEqual(Node.objects.count(), 0)
+            store.create(Node, osmid=2)
+            self.assertEqual(Node.objects.count(), 2)
+            store.create(Node, osmid=3)
+            store.flush()
+        self.assertEqual(Node.objects.count(), 3)
+
+    def test_add_related(self):
+        store = BulkObjectStore()
+        with transaction.atomic():
+            diff = store.create(Diff)
+            actions = [
+                store.create(
+                    Action, type=Action.CREATE,
+                    new=store.create(Node, osmid=i))
+                for i in range(3)]
+            store.add_related(diff.actions, actions)
+            store.flush()
+
+        self.assertEqual(Diff.objects.get().actions.count(), 3)
+
+
+class TestRowCollectorStore(TestCase):
+    def test_rows_roundtrip(self):
+        Way.objects.create(osmid=1234)  # takes pk 1
+
+        collector = RowCollectorStore()
+        way = collector.create(Way, osmid=1)
+        node = collector.create(Node, osmid=2, lat='48.1', lon='2.1')
+        collector.create(WayNode, way=way, node=node, order=0)
+        collector.create(Tag, element=way, k='highway', v='primary')
+        collector.flush()
+        # Provisional pks, nothing written
+        self.assertEqual([way.pk, node.pk], [1, 2])
+        self.assertEqual(OSMElement.objects.count(), 1)
+
+        rows = collector.get_rows()
+        with transaction.atomic():
+            created = BulkObjectStore().write_rows(rows)
+
+        written_way = created[Way][0]
+        self.assertEqual(written_way.pk, 2)
+        self.assertEqual(
+            list(Way.objects.get(pk=written_way.pk).nodes_list()),
+            [(2, 48.1, 2.1)])
+        self.assertEqual(written_way.tags_dict(), {'highway': 'primary'})
+        self.assertIsNotNone(Node.objects.get().latlon)
@@ -0,0 +1,131 @@
+""" Performance measurement of the processing stages
+
+Runs the import, patches, analysis, then each filter and each exporter on
+their own, on adiff files (see osmdata.generators for big ones), and compares
+the results to a baseline of a previous run.
+"""
+import json
+import os
+
+from diffanalysis.exporters import AnalyzedCSVExporter
+from diffanalysis.models import ActionReport
+from osmdata.exporters import AdiffExporter, CSVExporter
+from osmdata.filters import (
+    IgnoreElementsCreation, IgnoreElementsModification, IgnoreKeys,
+    IgnoreSmallNodeMoves, IgnoreUsers)
+from osmdata.importers import AdiffImporter
+from osmdata.patchers import FixRemoveOperationMetadata
+
+from .metrics import WorkflowMetrics
+
+
+class Benchmark:
+    """ Measures each stage on its own, on the actions of an adiff file
+
+    Each filter is applied to all the imported actions, not to the output of
+    the previous one, so that they are measured on the same input.
+    """
+    # Name, class and params of the measured filters
+    FILTERS = (
+        ('IgnoreUsers', IgnoreUsers, [['Mapper 1', 'Mapper 2', 'Mapper 3']]),
+        ('IgnoreElementsCreation', IgnoreElementsCreation, ['amenity=*']),
+        ('IgnoreElementsModification', IgnoreElementsModification,
+         ['building=*']),
+        ('IgnoreKeys', IgnoreKeys, [['source', 'note']]),
+        ('IgnoreSmallNodeMoves', IgnoreSmallNodeMoves, [5]),
+    )
+    # Name, class and params of the measured exporters
+    EXPORTERS = (
+        ('CSVExporter', CSVExporter, []),
+        ('AnalyzedCSVExporter', AnalyzedCSVExporter, []),
+        ('AdiffExporter', AdiffExporter, [True]),
+        ('AdiffExporter(templates)', AdiffExporter, [False]),
+    )
+
+    # Metrics compared to the baseline
+    COMPARED_METRICS = ('wall_seconds', 'queries', 'peak_rss_bytes')
+    # Timing differences below that are noise, whatever the tolerance
+    MIN_SIGNIFICANT_SECONDS = 0.1
+
+    def __init__(self, name):
+        """
+        :param name: identifies the input in results and baselines
+        """
+        self.name = name
+        self.metrics = WorkflowMetrics(name)
+
+    def run(self, input_path):
+        metrics = self.metrics
+        with metrics.measure('import') as measure:
+            diff = AdiffImporter().run(input_path)
+            measure.actions = diff.actions
+        qs = diff.actions.all()
+
+        with metrics.measure('patch', qs):
+            FixRemoveOperationMetadata().patch(qs)
+        with metrics.measure('reports', qs):
+            ActionReport.objects.create_for_queryset(qs)
+
+        for name, filter_class, params in self.FILTERS:
+            with metrics.measure('filter:{}'.format(name), qs) as measure:
+                measure.actions = filter_class(*params).filter(qs)
+
+        for name, exporter_class, params in self.EXPORTERS:
+            with metrics.measure('export:{}'.format(name), qs), \
+                    open(os.devnull, 'w') as stream:
+                exporter_class(*params).write(qs, stream)
+        return metrics
+
+    @staticmethod
+    def get_throughput(record):
+        """ Actions processed per second by a step
+        """
+        actions = record['actions_in']
+        if actions is None:
+            actions = record['actions_out']
+        if not record['wall_seconds']:
+            return None
+        return actions / record['wall_seconds']
+
+    @staticmethod
+    def load_baseline(path):
+        """
+        :return: the steps records of each input, by input name then step
+        """
+        with open(path) as f:
+            baseline = json.load(f)
+        return {
+            run['workflow']: {i['step']: i for i in run['steps']}
+            for run in baseline}
+
+    @staticmethod
+    def save_baseline(path, benchmarks):
+        with open(path, 'w') as f:
+            json.dump([i.metrics.as_dict() for i in benchmarks], f, indent=2)
+
+    def compare(self, baseline, tolerance):
+        """ Compares the steps to those of the baseline
+
+        :param baseline: see load_baseline()
+        :param tolerance: relative increase above which a metric regressed
+        :return: for each step, its record, the baseline one (None if
+          missing) and the regressed metrics names
+        :rtype: list of tuples
+        """
+        baseline_steps = baseline.get(self.name, {})
+        comparison = []
+        for record in self.metrics.steps:
+            baseline_record = baseline_steps.get(record['step'])
+            regressions = []
+            if baseline_record:
+                for name in self.COMPARED_METRICS:
+                    value, reference = record[name], baseline_record.get(name)
+                    if value is None or reference is None:
+                        continue
+                    if (name == 'wall_seconds' and
+                            value - reference < self.MIN_SIGNIFICANT_SECONDS):
+                        continue
+                    if value > reference * (1 + tolerance):
+                        regressions.append(name)
+            comparison.append((record, baseline_record, regressions))
+        return comparison
@@ -0,0 +1,114 @@
+import logging
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from osmdata.generators import AdiffGenerator
+from osmdata.sqlite import bulk_import_profile
+
+from ...benchmark import Benchmark
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Measure import, analysis, filters and exporters, on a scratch ' +
+            'database, and compare them to a baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--actions', type=int, nargs='+', default=[],
+            help="Measure on generated adiffs of those numbers of actions " +
+            "(see generate_adiff command for other mixes)")
+        parser.add_argument(
+            '--input-paths', nargs='+', default=[],
+            help="Measure on those adiff files")
+        parser.add_argument(
+            '--baseline', metavar='PATH',
+            help="Compare to the results of a previous run")
+        parser.add_argument(
+            '--save-baseline', metavar='PATH',
+            help="Write the results, to compare next runs to")
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help="Relative increase of time, queries or memory taken as a " +
+            "regression (default: 0.2)")
+
+    def handle(self, actions, input_paths, baseline, save_baseline,
+               tolerance, *args, **options):
+        if not actions and not input_paths:
+            raise CommandError('Either --actions or --input-paths is required')
+
+        baseline_steps = Benchmark.load_baseline(baseline) if baseline else {}
+        benchmarks = []
+        regressions = 0
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            inputs = [(os.path.basename(i), i) for i in input_paths]
+            for count in actions:
+                path = os.path.join(tmp_dir, '{}.osm'.format(count))
+                logger.info('Generating {} actions…'.format(count))
+                AdiffGenerator(actions=count).write_file(path)
+                inputs.append(('generated-{}'.format(count), path))
+
+            for name, path in inputs:
+                benchmark = Benchmark(name)
+                logger.info('Measuring "{}"…'.format(name))
+                self.run_isolated(benchmark, path)
+                benchmarks.append(benchmark)
+                regressions += self.report(
+                    benchmark, baseline_steps, tolerance)
+
+        if save_baseline:
+            Benchmark.save_baseline(save_baseline, benchmarks)
+        if regressions:
+            raise CommandError('{} regressions'.format(regressions))
+
+    @staticmethod
+    def run_isolated(benchmark, path):
+        """ Runs a benchmark on a fresh database, destroyed afterwards
+
+        Its DEBUG setting off, Django does not keep the queries.
+        """
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(DEBUG=False), bulk_import_profile():
+                benchmark.run(path)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def report(self, benchmark, baseline_steps, tolerance):
+        """ Writes the results of a benchmark, along with the baseline ones
+
+        :return: the number of regressed metrics
+        """
+        self.stdout.write('\n{}\n'.format(benchmark.name))
+        self.stdout.write('{:<40} {:>12} {:>9} {:>8} {:>9} {:>9}'.format(
+            'step', 'actions/s', 'wall (s)', 'queries', 'RSS (MiB)',
+            'baseline'))
+        regressions = 0
+        comparison = benchmark.compare(baseline_steps, tolerance)
+        for record, baseline_record, regressed in comparison:
+            throughput = Benchmark.get_throughput(record)
+            if baseline_record:
+                ratio = '{:+.0%}'.format(
+                    record['wall_seconds'] / baseline_record['wall_seconds'] - 1
+                ) if baseline_record['wall_seconds'] else '-'
+            else:
+                ratio = 'new'
+            rss = record['peak_rss_bytes']
+            self.stdout.write(
+                '{:<40} {:>12} {:>9.3f} {:>8} {:>9} {:>9}{}'.format(
+                    record['step'],
+                    '{:.0f}'.format(throughput) if throughput else '-',
+                    record['wall_seconds'], record['queries'],
+                    '{:.0f}'.format(rss / 2 ** 20) if rss else '-',
+                    ratio,
+                    '  REGRESSED: {}'.format(', '.join(regressed))
+                    if regressed else ''))
+            regressions += len(regressed)
+        return regressions
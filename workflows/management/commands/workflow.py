@@ -1,9 +1,14 @@
+from contextlib import ExitStack
 import logging
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
+from osmdata.sqlite import bulk_import_profile
+
+from ...metrics import WorkflowMetrics
 from ...models import WorkFlow
+from ...watch import DirectoryWatcher
 
 
 logger = logging.getLogger(__name__)
@@ -29,6 +34,40 @@ class Command(BaseCommand):
             '--output-paths', nargs="*", default=[],
             help="The path of the output file(s) to import, if you omit that" +
             "argument the output(s) will be printed on standard output")
+        parser.add_argument(
+            '--jobs', type=int, default=1,
+            help="Number of processes parsing the input files in parallel, " +
+            "when the workflow has several import steps (default: 1)")
+        parser.add_argument(
+            '--resume', action='store_true',
+            help="Resume interrupted imports of the input files rather " +
+            "than importing them from scratch")
+        parser.add_argument(
+            '--explain', action='store_true',
+            help="Print the SQL of the filtered actions queries, and their " +
+            "SQLite query plan, on standard error")
+        parser.add_argument(
+            '--in-memory', action='store_true',
+            help="Run the workflow on in-memory data, without storing " +
+            "anything in database (every filter must support it)")
+        parser.add_argument(
+            '--watch', metavar='DIR',
+            help="Keep running, processing each file landing in DIR " +
+            "(instead of --input-paths), then moving it to DIR/done or " +
+            "DIR/failed. Output paths may contain {name}, replaced by " +
+            "the input file name without extension")
+        parser.add_argument(
+            '--watch-interval', type=float, default=5,
+            help="Seconds between two scans of an idle watched directory " +
+            "(default: 5)")
+        parser.add_argument(
+            '--metrics', metavar='PATH',
+            help="Write the time, SQL queries, memory and actions count of " +
+            "each step to PATH, as JSON (- to log it)")
+        parser.add_argument(
+            '--metrics-prometheus', metavar='PATH',
+            help="Write the same metrics to PATH, in Prometheus text " +
+            "format (ex: for node_exporter textfile collector)")
 
     def _validate_output_paths(self, workflow, output_paths):
         outputs = [step for step in workflow.steps
@@ -50,7 +89,9 @@ class Command(BaseCommand):
         return input_paths
 
 
-    def handle(self, workflow_name, input_paths, output_paths, *args, **options):
+    def handle(self, workflow_name, input_paths, output_paths, jobs, resume,
+               explain, in_memory, watch, watch_interval, metrics,
+               metrics_prometheus, *args, **options):
         # Build a workflow index, by name
         workflows = {
             workflow['name']: workflow for workflow in settings.WORKFLOWS
@@ -72,8 +113,59 @@ class Command(BaseCommand):
             logger.debug('[0] OK\n')
 
         output_paths = self._validate_output_paths(workflow, output_paths)
+        explain = self.stderr if explain else None
+
+        if watch:
+            if metrics or metrics_prometheus:
+                raise LoggedCommandError(
+                    'Metrics are not available when watching a directory')
+            self._watch(
+                workflow, watch, output_paths, watch_interval,
+                explain=explain, in_memory=in_memory)
+            return
+
         input_paths = self._validate_input_paths(workflow, input_paths)
 
+        if metrics or metrics_prometheus:
+            workflow_metrics = WorkflowMetrics(workflow_name)
+        else:
+            workflow_metrics = None
+
         logger.info('[1] Running workflow {}…'.format(workflow_name))
-        workflow.run(input_paths, output_paths)
+        with ExitStack() as stack:
+            # In-memory runs leave the database alone
+            if not in_memory:
+                stack.enter_context(bulk_import_profile())
+            workflow.run(
+                input_paths, output_paths, jobs=jobs, resume=resume,
+                explain=explain, in_memory=in_memory,
+                metrics=workflow_metrics)
         logger.info('[1] OK')
+
+        if workflow_metrics:
+            self._write_metrics(
+                workflow_metrics, metrics, metrics_prometheus)
+
+    @staticmethod
+    def _write_metrics(workflow_metrics, path, prometheus_path):
+        if path == '-':
+            logger.info('Metrics: {}'.format(workflow_metrics.to_json()))
+        elif path:
+            with open(path, 'w') as f:
+                f.write(workflow_metrics.to_json())
+        if prometheus_path:
+            workflow_metrics.write_prometheus(prometheus_path)
+
+    def _watch(self, workflow, directory, output_paths, interval, **run_kwargs):
+        try:
+            watcher = DirectoryWatcher(
+                workflow, directory, output_paths, interval=interval,
+                run_kwargs=run_kwargs)
+        except (ValueError, OSError) as e:
+            raise LoggedCommandError(str(e))
+
+        with bulk_import_profile():
+            try:
+                watcher.watch()
+            except KeyboardInterrupt:
+                logger.info('Stopped watching "{}"'.format(directory))
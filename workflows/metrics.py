@@ -0,0 +1,152 @@
+""" Workflow instrumentation
+
+Records, for each step of a workflow run, what it cost, so that slow steps can
+be spotted, and regressions tracked across runs.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import sys
+import time
+
+from django.db import connection
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def get_peak_rss():
+    """ Peak resident memory of the current process so far
+
+    :return: a number of bytes, None if unknown on that platform
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts in KiB, macOS in bytes
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class QueryCounter:
+    """ Database execute wrapper, counting and timing queries
+    """
+    def __init__(self):
+        self.count = 0
+        self.time = 0.
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - start
+
+
+class StepMeasure:
+    """ Handed to the measured code, which tells the step output with it
+    """
+    def __init__(self):
+        # The actions handed to next steps, if not the input ones
+        self.actions = None
+
+
+class WorkflowMetrics:
+    """ Metrics of the steps of a workflow run
+    """
+    # Name and help of each step metric
+    METRICS = (
+        ('wall_seconds', 'Wall time of the step'),
+        ('cpu_seconds', 'CPU time of the step, in the main process'),
+        ('queries', 'Number of SQL queries run by the step'),
+        ('sql_seconds', 'Time spent in SQL queries by the step'),
+        ('peak_rss_bytes', 'Peak resident memory of the process at step end'),
+        ('actions_in', 'Number of actions handed to the step'),
+        ('actions_out', 'Number of actions handed to the next steps'),
+    )
+
+    PROMETHEUS_PREFIX = 'osmada_workflow_step_'
+
+    def __init__(self, workflow_name):
+        self.workflow_name = workflow_name
+        self.steps = []
+
+    @staticmethod
+    def count_actions(actions):
+        return actions.count() if actions is not None else None
+
+    @contextmanager
+    def measure(self, step_name, actions=None):
+        """ Measures the code run within the context
+
+        :param actions: the actions handed to the step
+        """
+        record = OrderedDict(step=step_name)
+        record['actions_in'] = self.count_actions(actions)
+        measure = StepMeasure()
+        queries = QueryCounter()
+
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        with connection.execute_wrapper(queries):
+            yield measure
+            # Counted within the step: filtered querysets being lazy, that
+            # is when their query runs.
+            record['actions_out'] = self.count_actions(
+                actions if measure.actions is None else measure.actions)
+        record['wall_seconds'] = time.perf_counter() - start_wall
+        record['cpu_seconds'] = time.process_time() - start_cpu
+        record['queries'] = queries.count
+        record['sql_seconds'] = queries.time
+        record['peak_rss_bytes'] = get_peak_rss()
+        self.steps.append(record)
+
+    def as_dict(self):
+        return OrderedDict([
+            ('workflow', self.workflow_name),
+            ('steps', self.steps),
+        ])
+
+    def to_json(self):
+        return json.dumps(self.as_dict())
+
+    @staticmethod
+    def _escape_label(value):
+        return str(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n')
+
+    def to_prometheus(self):
+        """ Metrics in Prometheus text exposition format
+        """
+        lines = []
+        for name, help_text in self.METRICS:
+            metric = self.PROMETHEUS_PREFIX + name
+            lines.append('# HELP {} {}'.format(metric, help_text))
+            lines.append('# TYPE {} gauge'.format(metric))
+            for index, record in enumerate(self.steps):
+                if record[name] is None:
+                    continue
+                lines.append('{}{{workflow="{}",index="{}",step="{}"}} {}'.format(
+                    metric, self._escape_label(self.workflow_name), index,
+                    self._escape_label(record['step']), record[name]))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """ Writes a textfile, for node_exporter textfile collector
+
+        Written aside, then renamed, so that it is never read half-written.
+        """
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+class NoMetrics:
+    """ Stands for WorkflowMetrics when nothing is to be measured
+    """
+    @contextmanager
+    def measure(self, step_name, actions=None):
+        yield StepMeasure()
@@ -1,11 +1,20 @@
+from itertools import groupby
 import logging
+from operator import attrgetter
 
 from django.utils.module_loading import import_string
 
 
+from diffanalysis.memory import MemoryActionReport
 from diffanalysis.models import ActionReport
+from osmdata.filters import FilterChain
+from osmdata.importers import AdiffImporter, ParallelAdiffImporter
+from osmdata.memory import RelatedList
 from osmdata.models import Action
 from osmdata.patchers import FixRemoveOperationMetadata
+from osmdata.sqlite import explain_query_plan
+
+from .metrics import NoMetrics
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +57,40 @@ class WorkFlow:
         self.steps = steps
         self.diff = None
 
-    def run(self, input_paths, output_paths):
+    def get_parallel_imports(self, input_paths, jobs):
+        """ Starts parsing all the import steps inputs in parallel
+
+        :return: a generator yielding the imported diffs, in steps order
+        """
+        importers = [step.instance for step in self.steps
+                     if step.type == step.STEP_IMPORT]
+        if not all(type(i) is AdiffImporter for i in importers):
+            raise ValueError('Only AdiffImporter steps can run in parallel')
+
+        return ParallelAdiffImporter(
+            jobs=jobs, batch_size=importers[0].batch_size,
+            deduplicate=importers[0].deduplicate,
+        ).run_many(input_paths)
+
+    def run(self, input_paths, output_paths, jobs=1, resume=False,
+            explain=None, in_memory=False, metrics=None):
+        """
+        :param jobs: if above 1 and the workflow has several import steps,
+          their inputs are parsed in parallel by that number of processes
+        :param resume: resume interrupted imports of the inputs, if any
+        :param explain: a file-like object, to write the SQL and query plan
+          of filtered querysets to
+        :param in_memory: run the whole workflow on in-memory objects (see
+          osmdata.memory), without storing anything in database. jobs,
+          resume and explain are then ignored.
+        :param metrics: a WorkflowMetrics, to record the cost of each step in
+
+        Afterwards, last_step_output holds the output of the last step: the
+        actions for import and filter steps. For export steps, it holds the
+        output path when the exporter streams its output (has a write()
+        method, as the exporters shipped with osmada), or what the run()
+        method of the exporter returned otherwise.
+        """
         qs = Action.objects.none()
         diff = None
         self.last_step_output = None
@@ -56,49 +98,126 @@ class WorkFlow:
         output_paths_stack = reversed_copy(output_paths)
         input_paths_stack = reversed_copy(input_paths)
 
-        for step in self.steps:
+        if metrics is None:
+            metrics = NoMetrics()
+
+        parallel_imports = None
+        if jobs > 1 and len(input_paths) > 1 and not in_memory:
+            parallel_imports = self.get_parallel_imports(input_paths, jobs)
+
+        for step in self.get_stages():
             logger.debug('Running step {}'.format(step.instance))
+            step_name = self.get_stage_name(step)
 
             if step.type == step.STEP_IMPORT:
                 input_path = input_paths_stack.pop()
                 logger.info('Importing from "{}"'.format(input_path))
                 logger.debug('next steps will use this data')
-                diff = step.instance.run(input_path)
-                # every import step overwrite any previous qs :
-                qs = diff.actions
+                with metrics.measure(step_name) as measure:
+                    if in_memory:
+                        diff = step.instance.run_in_memory(input_path)
+                    elif parallel_imports:
+                        diff = next(parallel_imports)
+                    else:
+                        diff = step.instance.run(input_path, resume=resume)
+                    # every import step overwrite any previous qs :
+                    qs = diff.actions
+                    measure.actions = qs
                 self.last_step_output = qs
-                for patch_name in self.apply_data_patches(qs):
-                    logger.debug('Applying data patch {}'.format(patch_name))
 
-                self.make_action_reports(qs)
+                with metrics.measure('patch', qs):
+                    for patch_name in self.apply_data_patches(qs, in_memory):
+                        logger.debug(
+                            'Applying data patch {}'.format(patch_name))
+
+                with metrics.measure('reports', qs):
+                    self.make_action_reports(qs, in_memory)
 
             elif step.type == step.STEP_EXPORT:
                 output_path = output_paths_stack.pop()
                 logger.info('Exporting to "{}"'.format(output_path))
-                output = step.instance.run(qs)
-                with open(output_path, 'w') as output_fd:
-                    output_fd.write(str(output))
+                with metrics.measure(step_name, qs), \
+                        open(output_path, 'w') as output_fd:
+                    if hasattr(step.instance, 'write'):
+                        # Streamed, rather than built in memory at once
+                        step.instance.write(qs, output_fd)
+                        output = output_path
+                    else:
+                        output = step.instance.run(qs)
+                        output_fd.write(str(output))
                 self.last_step_output = output
 
             elif step.type == step.STEP_FILTER:
-                qs = step.instance.filter(qs)
+                with metrics.measure(step_name, qs) as measure:
+                    if in_memory:
+                        qs = RelatedList(
+                            action for action in qs
+                            if step.instance.keep(action))
+                    else:
+                        qs = step.instance.filter(qs)
+                    measure.actions = qs
                 self.last_step_output = qs
+                if explain and not in_memory:
+                    self.explain(qs, explain)
 
-    def make_action_reports(self, qs):
+    @staticmethod
+    def get_stage_name(step):
+        """ Name of a stage, for metrics
+        """
+        if isinstance(step.instance, FilterChain):
+            classes = [type(i) for i in step.instance.filters]
+        else:
+            classes = [type(step.instance)]
+        return '{}:{}'.format(
+            step.type, '+'.join(i.__name__ for i in classes))
+
+    def get_stages(self):
+        """ The steps, consecutive filter steps being merged into one
+
+        Their conditions are thus compiled into a single query.
+
+        :rtype: list of Step
+        """
+        stages = []
+        for step_type, steps in groupby(self.steps, key=attrgetter('type')):
+            if step_type == Step.STEP_FILTER:
+                stages.append(Step(
+                    Step.STEP_FILTER, FilterChain,
+                    [[step.instance for step in steps]]))
+            else:
+                stages.extend(steps)
+        return stages
+
+    @staticmethod
+    def explain(qs, stream):
+        """ Writes the SQL of an Action queryset, and its query plan
+
+        :param stream: a file-like object
+        """
+        stream.write('-- SQL\n{};\n'.format(qs.query))
+        stream.write('-- Query plan\n{}\n'.format(
+            '\n'.join(explain_query_plan(qs))))
+
+    def make_action_reports(self, qs, in_memory=False):
         """ Make an ActionReport for each Action of the queryset
 
         This operation is costly, but the result might be used by some
         filters.
 
-        :type qs: an Action QuerySet
+        :type qs: an Action QuerySet, or in-memory actions
+        :param in_memory: attach a MemoryActionReport to each action instead
         """
-        for action in qs.all():
-            ActionReport.objects.get_or_create_for_action(action)
+        if in_memory:
+            for action in qs:
+                MemoryActionReport(action)
+        else:
+            ActionReport.objects.create_for_queryset(qs)
 
-    def apply_data_patches(self, qs):
+    def apply_data_patches(self, qs, in_memory=False):
         """ That step modifies the data in database
 
-        :type qs: an Action QuerySet
+        :type qs: an Action QuerySet, or in-memory actions
+        :param in_memory: patch in-memory actions instead
         This is mainly intended for workarounds
         """
         # Make it configurable ?
@@ -106,7 +225,10 @@ class WorkFlow:
         for PatchClass in patches:
             patch = PatchClass()
             yield patch.description
-            patch.patch(qs)
+            if in_memory:
+                patch.patch_in_memory(qs)
+            else:
+                patch.patch(qs)
 
     @classmethod
     def from_settings(cls, name, spec):
@@ -1,3 +1,11 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
 from django.test import TestCase
 
 from diffanalysis.models import ActionReport
@@ -5,10 +13,14 @@ import osmdata
 from osmdata.filters import IgnoreUsers, IgnoreElementsCreation, IgnoreElementsModification, AbstractActionFilter
 from osmdata.importers import AdiffImporter
 from osmdata.exporters import CSVExporter
+from osmdata.generators import AdiffGenerator
 from osmdata.models import Diff
 from osmdata.tests.utils import get_test_file_path
 
+from .benchmark import Benchmark
+from .metrics import WorkflowMetrics
 from .models import Step, WorkFlow
+from .watch import DirectoryWatcher
 
 class TestWorkFlow(TestCase):
     fixtures = ['test_filters.json']  # Versailles Chantier
@@ -106,6 +118,19 @@ class TestWorkFlow(TestCase):
         wf.run([get_test_file_path('create_action.osm')], ['/dev/null'])
         self.assertEqual(wf.last_step_output, 1)
 
+    def test_streamed_output(self):
+        wf = WorkFlow(
+            name='test',
+            steps=[
+                Step(Step.STEP_IMPORT, osmdata.importers.AdiffImporter, []),
+                Step(Step.STEP_EXPORT, CSVExporter, [])
+            ]
+        )
+        with tempfile.NamedTemporaryFile('r') as f:
+            wf.run([get_test_file_path('create_action.osm')], [f.name])
+            self.assertEqual(wf.last_step_output, f.name)
+            self.assertEqual(len(f.read().splitlines()), 2)
+
     def test_filter_filter_in(self):
         wf = WorkFlow(
             name='test',
@@ -118,6 +143,36 @@ class TestWorkFlow(TestCase):
         wf.run([get_test_file_path('create_action.osm')], ['/dev/null'])
         self.assertEqual(wf.last_step_output.count(), 1)
 
+    def test_consecutive_filters_merged(self):
+        wf = WorkFlow(
+            name='test',
+            steps=[
+                Step(Step.STEP_IMPORT, osmdata.importers.AdiffImporter, []),
+                Step(Step.STEP_FILTER, osmdata.filters.IgnoreUsers, [["foo"]]),
+                Step(Step.STEP_FILTER, osmdata.filters.IgnoreUsers, [["bar"]]),
+                Step(Step.STEP_EXPORT, CSVExporter, []),
+                Step(Step.STEP_FILTER, osmdata.filters.IgnoreUsers, [["baz"]]),
+            ]
+        )
+        self.assertEqual(
+            [step.type for step in wf.get_stages()],
+            [Step.STEP_IMPORT, Step.STEP_FILTER, Step.STEP_EXPORT,
+             Step.STEP_FILTER])
+        self.assertEqual(len(wf.get_stages()[1].instance.filters), 2)
+
+    def test_explain(self):
+        wf = WorkFlow(
+            name='test',
+            steps=[
+                Step(Step.STEP_IMPORT, osmdata.importers.AdiffImporter, []),
+                Step(Step.STEP_FILTER, osmdata.filters.IgnoreUsers, [["foo"]]),
+            ]
+        )
+        explain = io.StringIO()
+        wf.run([get_test_file_path('create_action.osm')], [], explain=explain)
+        self.assertIn('-- SQL\nSELECT', explain.getvalue())
+        self.assertIn('-- Query plan\n', explain.getvalue())
+
     def test_filter_filter_out(self):
         wf = WorkFlow(
             name='test',
@@ -128,3 +183,254 @@ class TestWorkFlow(TestCase):
         )
         wf.run([get_test_file_path('create_action.osm')], ['/dev/null'])
         self.assertEqual(wf.last_step_output.count(), 0)
+
+    def test_in_memory_same_output(self):
+        steps = [
+            Step(Step.STEP_IMPORT, osmdata.importers.AdiffImporter, []),
+            Step(Step.STEP_FILTER, osmdata.filters.IgnoreUsers, [["foo"]]),
+            Step(Step.STEP_FILTER, osmdata.filters.IgnoreKeys, [["note"]]),
+            Step(Step.STEP_EXPORT, CSVExporter, []),
+            Step(Step.STEP_EXPORT, osmdata.exporters.AdiffExporter, []),
+        ]
+        path = get_test_file_path('multiple_actions.osm')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_outputs = [os.path.join(tmp_dir, i) for i in ('a.csv', 'a.osm')]
+            memory_outputs = [
+                os.path.join(tmp_dir, i) for i in ('b.csv', 'b.osm')]
+
+            wf = WorkFlow(name='test', steps=steps)
+            wf.run([path], db_outputs)
+            diffs_count = Diff.objects.count()
+            wf.run([path], memory_outputs, in_memory=True)
+
+            for db_output, memory_output in zip(db_outputs, memory_outputs):
+                with open(db_output) as db_f, open(memory_output) as memory_f:
+                    self.assertEqual(memory_f.read(), db_f.read())
+        # Nothing was stored
+        self.assertEqual(Diff.objects.count(), diffs_count)
+
+    def test_in_memory_filter(self):
+        wf = WorkFlow(
+            name='test',
+            steps=[
+                Step(Step.STEP_IMPORT, osmdata.importers.AdiffImporter, []),
+                Step(Step.STEP_FILTER, osmdata.filters.IgnoreUsers, [["Yann_L"]])
+            ]
+        )
+        wf.run([get_test_file_path('create_action.osm')], ['/dev/null'],
+               in_memory=True)
+        self.assertEqual(wf.last_step_output.count(), 0)
+
+
+class TestWorkflowMetrics(TestCase):
+    def run_workflow(self, **kwargs):
+        wf = WorkFlow(
+            name='test',
+            steps=[
+                Step(Step.STEP_IMPORT, osmdata.importers.AdiffImporter, []),
+                Step(Step.STEP_FILTER, osmdata.filters.IgnoreUsers, [["foo"]]),
+                Step(Step.STEP_FILTER, osmdata.filters.IgnoreUsers,
+                     [["Yann_L"]]),
+                Step(Step.STEP_EXPORT, CSVExporter, []),
+            ]
+        )
+        metrics = WorkflowMetrics('test')
+        wf.run([get_test_file_path('create_action.osm')], ['/dev/null'],
+               metrics=metrics, **kwargs)
+        return metrics
+
+    def test_steps(self):
+        metrics = self.run_workflow()
+        self.assertEqual(
+            [record['step'] for record in metrics.steps],
+            ['import:AdiffImporter', 'patch', 'reports',
+             'filter:IgnoreUsers+IgnoreUsers', 'export:CSVExporter'])
+        self.assertEqual(
+            [(record['actions_in'], record['actions_out'])
+             for record in metrics.steps],
+            [(None, 1), (1, 1), (1, 1), (1, 0), (0, 0)])
+
+        for record in metrics.steps:
+            self.assertEqual(
+                set(record),
+                {'step'} | {name for name, _ in WorkflowMetrics.METRICS})
+            self.assertGreaterEqual(record['wall_seconds'], 0)
+        # The import writes to database
+        self.assertGreater(metrics.steps[0]['queries'], 0)
+
+    def test_steps_in_memory(self):
+        metrics = self.run_workflow(in_memory=True)
+        self.assertEqual(
+            [record['actions_out'] for record in metrics.steps],
+            [1, 1, 1, 0, 0])
+        self.assertEqual(
+            [record['queries'] for record in metrics.steps], [0] * 5)
+
+    def test_prometheus(self):
+        metrics = WorkflowMetrics('my "wf"')
+        with metrics.measure('filter:IgnoreUsers'):
+            pass
+        lines = metrics.to_prometheus().splitlines()
+
+        self.assertIn(
+            '# TYPE osmada_workflow_step_wall_seconds gauge', lines)
+        self.assertIn(
+            'osmada_workflow_step_queries{workflow="my \\"wf\\"",'
+            'index="0",step="filter:IgnoreUsers"} 0', lines)
+        # No actions count
+        self.assertFalse(any(
+            i.startswith('osmada_workflow_step_actions_in{') for i in lines))
+
+    def test_write_prometheus(self):
+        metrics = WorkflowMetrics('test')
+        with metrics.measure('patch'):
+            pass
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'osmada.prom')
+            metrics.write_prometheus(path)
+            self.assertEqual(os.listdir(tmp_dir), ['osmada.prom'])
+            with open(path) as f:
+                self.assertEqual(f.read(), metrics.to_prometheus())
+
+
+class TestBenchmark(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.tmp_dir, 'generated.osm')
+        AdiffGenerator(actions=50).write_file(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+        super().tearDownClass()
+
+    def test_run(self):
+        benchmark = Benchmark('test')
+        benchmark.run(self.path)
+        steps = [record['step'] for record in benchmark.metrics.steps]
+        self.assertEqual(steps[:3], ['import', 'patch', 'reports'])
+        self.assertEqual(
+            steps[3:],
+            ['filter:{}'.format(i[0]) for i in Benchmark.FILTERS] +
+            ['export:{}'.format(i[0]) for i in Benchmark.EXPORTERS])
+
+        for record in benchmark.metrics.steps[1:]:
+            self.assertEqual(record['actions_in'], 50)
+        self.assertEqual(benchmark.metrics.steps[0]['actions_out'], 50)
+        self.assertIsNotNone(
+            Benchmark.get_throughput(benchmark.metrics.steps[0]))
+
+    def test_baseline(self):
+        benchmark = Benchmark('test')
+        with benchmark.metrics.measure('import'):
+            pass
+        benchmark.metrics.steps[0].update(wall_seconds=1, queries=100)
+
+        with tempfile.NamedTemporaryFile('r') as f:
+            Benchmark.save_baseline(f.name, [benchmark])
+            baseline = Benchmark.load_baseline(f.name)
+        self.assertEqual(list(baseline), ['test'])
+
+        (record, baseline_record, regressed), = benchmark.compare(
+            baseline, 0.2)
+        self.assertEqual(baseline_record['queries'], 100)
+        self.assertEqual(regressed, [])
+
+        record.update(wall_seconds=2, queries=110)
+        (_, _, regressed), = benchmark.compare(baseline, 0.2)
+        self.assertEqual(regressed, ['wall_seconds'])
+
+        # Not in baseline
+        other = Benchmark('other')
+        with other.metrics.measure('import'):
+            pass
+        (_, baseline_record, regressed), = other.compare(baseline, 0.2)
+        self.assertIsNone(baseline_record)
+        self.assertEqual(regressed, [])
+
+
+class TestDirectoryWatcher(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.watched = os.path.join(self.tmp_dir.name, 'in')
+        os.mkdir(self.watched)
+
+        self.workflow = WorkFlow(
+            name='test',
+            steps=[
+                Step(Step.STEP_IMPORT, osmdata.importers.AdiffImporter, []),
+                Step(Step.STEP_EXPORT, CSVExporter, [])
+            ]
+        )
+        self.watcher = DirectoryWatcher(
+            self.workflow, self.watched,
+            [os.path.join(self.tmp_dir.name, '{name}.csv')], min_age=0)
+
+    def drop_file(self, filename, name=None):
+        path = os.path.join(self.watched, name or filename)
+        shutil.copy(get_test_file_path(filename), path)
+        return path
+
+    def test_process_files(self):
+        self.drop_file('create_action.osm')
+        self.drop_file('invalid_action.osm')
+        self.drop_file('create_action.osm', '.partial.osm')
+
+        self.assertEqual(self.watcher.poll(), 2)
+
+        self.assertEqual(
+            os.listdir(os.path.join(self.watched, 'done')),
+            ['create_action.osm'])
+        self.assertEqual(
+            os.listdir(os.path.join(self.watched, 'failed')),
+            ['invalid_action.osm'])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmp_dir.name, 'create_action.csv')))
+        # Hidden files are left alone
+        self.assertEqual(self.watcher.poll(), 0)
+
+    def test_queue_size(self):
+        for i in range(3):
+            self.drop_file('create_action.osm', '{}.osm'.format(i))
+        self.watcher.queue_size = 2
+
+        self.assertEqual(self.watcher.poll(), 2)
+        self.assertEqual(self.watcher.poll(), 1)
+
+    def test_recent_files_ignored(self):
+        self.drop_file('create_action.osm')
+        self.watcher.min_age = 60
+        self.assertEqual(self.watcher.poll(), 0)
+
+    def test_single_import_required(self):
+        self.workflow.steps.append(self.workflow.steps[0])
+        with self.assertRaises(ValueError):
+            DirectoryWatcher(self.workflow, self.watched, [])
+
+
+class TestWorkflowCommand(TestCase):
+    def run_command(self, *args):
+        """ Runs manage.py in a new process, with command-line settings
+        """
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='osmada.cli_settings')
+        return subprocess.check_output(
+            [sys.executable, 'manage.py'] + list(args),
+            cwd=settings.BASE_DIR, env=env, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+
+    def test_help_cli_settings(self):
+        self.assertIn('--input-paths', self.run_command('workflow', '--help'))
+
+    def test_run_cli_settings(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, 'out.osm')
+            self.run_command(
+                'workflow', 'test_passthrough_adiff', '--in-memory',
+                '--input-paths', get_test_file_path('create_action.osm'),
+                '--output-paths', output_path)
+            with open(output_path) as f:
+                self.assertIn('<way id="444967525"', f.read())
@@ -0,0 +1,126 @@
+""" Long-running workflow execution, on files landing in a directory
+
+Saves the process startup (Django setup, GDAL loading, workflow parsing…) for
+each file, which is most of the cost of small files (ex: minutely diffs).
+"""
+import logging
+import os
+import shutil
+import time
+
+from django.db import close_old_connections, reset_queries
+
+logger = logging.getLogger(__name__)
+
+
+class DirectoryWatcher:
+    """ Runs a workflow on each new file of a directory
+
+    Files are processed oldest first, then moved to the "done" or "failed"
+    subdirectory, whatever their processing outcome.
+    """
+    DONE_DIR = 'done'
+    FAILED_DIR = 'failed'
+
+    def __init__(self, workflow, directory, output_paths, interval=5,
+                 min_age=1, queue_size=100, run_kwargs=None):
+        """
+        :param workflow: the WorkFlow to run, having a single import step
+        :param output_paths: one per export step, "{name}" being replaced by
+          the input file name, without extension
+        :param interval: seconds to wait between two scans of an idle
+          directory
+        :param min_age: seconds since last modification before a file is
+          picked up, so that files being written are left alone
+        :param queue_size: maximum number of files picked up at once, next
+          ones waiting for the next scan
+        :param run_kwargs: extra arguments for WorkFlow.run()
+        """
+        imports = [step for step in workflow.steps
+                   if step.type == step.STEP_IMPORT]
+        if len(imports) != 1:
+            raise ValueError(
+                'Only workflows with a single import step can watch a '
+                'directory')
+
+        self.workflow = workflow
+        self.directory = directory
+        self.output_paths = output_paths
+        self.interval = interval
+        self.min_age = min_age
+        self.queue_size = queue_size
+        self.run_kwargs = run_kwargs or {}
+
+        for subdir in (self.DONE_DIR, self.FAILED_DIR):
+            os.makedirs(os.path.join(directory, subdir), exist_ok=True)
+
+    def get_pending_paths(self):
+        """ Files ready to be processed, oldest first, up to queue_size
+
+        Hidden files (ex: being downloaded by rsync) are ignored.
+        """
+        now = time.time()
+        pending = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isfile(path):
+                continue
+            mtime = os.path.getmtime(path)
+            if now - mtime >= self.min_age:
+                pending.append((mtime, name, path))
+        return [path for _, _, path in sorted(pending)[:self.queue_size]]
+
+    def get_output_paths(self, input_path):
+        name = os.path.splitext(os.path.basename(input_path))[0]
+        return [i.format(name=name) for i in self.output_paths]
+
+    def process(self, input_path):
+        """ Runs the workflow on a file, then moves it away
+
+        :return: True if the workflow ran fine
+        """
+        logger.info('Processing "{}"'.format(input_path))
+        start = time.monotonic()
+        try:
+            self.workflow.run(
+                [input_path], self.get_output_paths(input_path),
+                **self.run_kwargs)
+        except Exception:
+            logger.exception('Failed processing "{}"'.format(input_path))
+            success = False
+        else:
+            logger.info('Processed "{}" in {:.2f}s'.format(
+                input_path, time.monotonic() - start))
+            success = True
+        finally:
+            # Do not let a long-running process accumulate debug queries, or
+            # hold broken connections.
+            reset_queries()
+            close_old_connections()
+
+        subdir = self.DONE_DIR if success else self.FAILED_DIR
+        shutil.move(input_path, os.path.join(
+            self.directory, subdir, os.path.basename(input_path)))
+        return success
+
+    def poll(self):
+        """ Processes the files pending so far
+
+        :return: the number of processed files
+        """
+        paths = self.get_pending_paths()
+        for path in paths:
+            self.process(path)
+        return len(paths)
+
+    def watch(self, max_polls=None):
+        """ Processes files as they come, until interrupted
+
+        :param max_polls: stop after that number of scans, never if None
+        """
+        logger.info('Watching "{}"'.format(self.directory))
+        polls = 0
+        while max_polls is None or polls < max_polls:
+            polls += 1
+            if not self.poll():
+                time.sleep(self.interval)